@@ -0,0 +1,173 @@
+import json
+import re
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from mypy_boto3_s3 import S3Client
+from prefect.logging import get_logger
+from pydantic import BaseModel
+
+logger = get_logger(__name__)
+
+CATALOG_KEY = "catalog.json"
+CATALOG_VERSION = 1
+
+# The key of the classifier metadata in each output, which is written last
+OUTPUT_CLASSIFIER_KEY_PATTERN = re.compile(
+    r"^(?P<wikibase_id>Q\d+)/(?P<classifier_id>[^/]+)/classifier\.json$"
+)
+
+# How many times to retry an update which conflicts with a concurrent update
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class CatalogEntry(BaseModel):
+    """The outputs of a classifier for a concept, as listed in the catalog."""
+
+    wikibase_id: str
+    classifier_id: str
+    classifier_name: str
+    preferred_label: str
+    date: str
+    n_passages: int
+    n_positive_passages: int
+    artifacts: dict[str, str]
+
+
+class Catalog(BaseModel):
+    """
+    Every concept and classifier with outputs in the bucket.
+
+    Entries are keyed on wikibase id and then classifier id, so that consumers can
+    discover all of the outputs with a single GET rather than listing the bucket.
+    """
+
+    version: int = CATALOG_VERSION
+    updated_at: str = ""
+    concepts: dict[str, dict[str, CatalogEntry]] = {}
+
+    def add(self, entry: CatalogEntry) -> None:
+        """Add an entry to the catalog, replacing any with the same ids."""
+        self.concepts.setdefault(entry.wikibase_id, {})[entry.classifier_id] = entry
+
+
+def _is_conflict(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in (
+        "PreconditionFailed",
+        "ConditionalRequestConflict",
+    )
+
+
+def load_catalog(s3_client: S3Client, bucket_name: str) -> tuple[Catalog, str | None]:
+    """Load the catalog from S3, along with its ETag (None if it doesn't exist)."""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=CATALOG_KEY)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+            return Catalog(), None
+        raise
+    return Catalog.model_validate_json(response["Body"].read()), response["ETag"]
+
+
+def discover_catalog_entries(
+    s3_client: S3Client, bucket_name: str
+) -> list[CatalogEntry]:
+    """
+    Build catalog entries for the outputs which are already in the bucket.
+
+    This lists the bucket, and reads every output's metadata and predictions, so it
+    should only be needed once, to seed the catalog with the outputs of runs from
+    before it existed.
+    """
+
+    def read_object(key: str) -> StreamingBody:
+        return s3_client.get_object(Bucket=bucket_name, Key=key)["Body"]
+
+    entries = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for item in page.get("Contents", []):
+            match = OUTPUT_CLASSIFIER_KEY_PATTERN.match(item.get("Key", ""))
+            if match is None:
+                continue
+            prefix = f"{match['wikibase_id']}/{match['classifier_id']}"
+            artifacts = {
+                "predictions": f"{prefix}/predictions.jsonl",
+                "concept": f"{prefix}/concept.json",
+                "classifier": f"{prefix}/classifier.json",
+            }
+            try:
+                classifier = json.loads(read_object(artifacts["classifier"]).read())
+                concept = json.loads(read_object(artifacts["concept"]).read())
+                n_passages, n_positive_passages = 0, 0
+                for line in read_object(artifacts["predictions"]).iter_lines():
+                    if line:
+                        n_passages += 1
+                        n_positive_passages += bool(json.loads(line).get("spans"))
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                    logger.warning(f"Skipping incomplete outputs in {prefix}")
+                    continue
+                raise
+            entries.append(
+                CatalogEntry(
+                    wikibase_id=match["wikibase_id"],
+                    classifier_id=match["classifier_id"],
+                    classifier_name=classifier.get("name", match["classifier_id"]),
+                    preferred_label=concept.get("preferred_label", ""),
+                    date=classifier.get("date", ""),
+                    n_passages=n_passages,
+                    n_positive_passages=n_positive_passages,
+                    artifacts=artifacts,
+                )
+            )
+    return entries
+
+
+def update_catalog(
+    s3_client: S3Client,
+    bucket_name: str,
+    entries: list[CatalogEntry],
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> Catalog:
+    """
+    Add entries to the catalog in S3.
+
+    The catalog is replaced in a single conditional PUT, which only succeeds if it
+    hasn't been changed since we read it. If another run updated it in the
+    meantime, we re-read it and try again, so that neither run's entries are lost.
+
+    If there's no catalog yet, it's seeded with the outputs which are already in
+    the bucket, so that it lists the outputs of runs from before it existed too.
+    """
+    existing_entries: list[CatalogEntry] | None = None
+    for attempt in range(1, max_attempts + 1):
+        catalog, etag = load_catalog(s3_client, bucket_name)
+        if etag is None:
+            if existing_entries is None:
+                logger.info(f"Seeding {CATALOG_KEY} with the existing outputs...")
+                existing_entries = discover_catalog_entries(s3_client, bucket_name)
+                logger.info(f"Found {len(existing_entries)} existing outputs")
+            for entry in existing_entries:
+                catalog.add(entry)
+        for entry in entries:
+            catalog.add(entry)
+        catalog.updated_at = datetime.now().isoformat(timespec="seconds")
+        body = json.dumps(catalog.model_dump(), indent=2, sort_keys=True)
+
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=CATALOG_KEY,
+                Body=body.encode("utf-8"),
+                ContentType="application/json",
+                **condition,  # type: ignore[arg-type]
+            )
+        except ClientError as e:
+            if _is_conflict(e) and attempt < max_attempts:
+                continue
+            raise
+        return catalog
+    raise RuntimeError("Failed to update the catalog")
@@ -0,0 +1,221 @@
+import gzip
+import hashlib
+import io
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+from botocore.exceptions import ClientError
+from knowledge_graph.span import Span
+from mypy_boto3_s3 import S3Client
+from prediction_cache import compact_spans, expand_spans, hash_text
+
+CHECKPOINT_PREFIX = "checkpoints"
+DEFAULT_CHECKPOINT_EVERY = 5_000
+
+
+class S3CheckpointStore:
+    """Reads and writes checkpoint files in S3."""
+
+    def __init__(self, s3_client: S3Client, bucket_name: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+
+    def read(self, key: str) -> bytes | None:
+        """Read a checkpoint file, or None if it doesn't exist."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return None
+            raise
+        return response["Body"].read()
+
+    def write(self, key: str, data: bytes) -> None:
+        """Write a checkpoint file."""
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+
+    def list(self, prefix: str) -> list[str]:
+        """List the checkpoint files under a prefix, in key order."""
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        keys = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f"{prefix}/"):
+            keys.extend(obj.get("Key", "") for obj in page.get("Contents", []))
+        return sorted(key for key in keys if key)
+
+    def delete(self, prefix: str) -> None:
+        """Delete every checkpoint file under a prefix."""
+        keys = self.list(prefix)
+        for i in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in keys[i : i + 1000]]},
+            )
+
+
+class LocalCheckpointStore:
+    """Reads and writes checkpoint files in a local directory."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def read(self, key: str) -> bytes | None:
+        """Read a checkpoint file, or None if it doesn't exist."""
+        path = self.root / key
+        return path.read_bytes() if path.exists() else None
+
+    def write(self, key: str, data: bytes) -> None:
+        """Write a checkpoint file."""
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that an interruption can't leave a
+        # partially written checkpoint behind
+        temporary_path = path.with_name(f"{path.name}.tmp")
+        temporary_path.write_bytes(data)
+        temporary_path.replace(path)
+
+    def list(self, prefix: str) -> list[str]:
+        """List the checkpoint files under a prefix, in key order."""
+        directory = self.root / prefix
+        if not directory.exists():
+            return []
+        return sorted(
+            str(path.relative_to(self.root))
+            for path in directory.rglob("*")
+            if path.is_file() and path.suffix != ".tmp"
+        )
+
+    def delete(self, prefix: str) -> None:
+        """Delete every checkpoint file under a prefix."""
+        shutil.rmtree(self.root / prefix, ignore_errors=True)
+
+
+CheckpointStore = S3CheckpointStore | LocalCheckpointStore
+
+
+class ConceptCheckpoint:
+    """
+    Checkpointed progress of inference for a single concept.
+
+    Checkpoints are stored under `checkpoints/{wikibase_id}/`, containing:
+
+    - `selection.npz`: the dataset index and similarity of the selected passages,
+      so that a resumed run doesn't need to re-encode the concept or re-select
+      passages
+    - `{classifier_id}/predictions-{n}.json.gz`: chunks of the classifier's
+      predictions, keyed on a hash of the passage text
+
+    The selection is only reused if the fingerprint of its inputs (eg the concept
+    definition and the selection strategy) hasn't changed since it was saved.
+    """
+
+    def __init__(
+        self,
+        store: CheckpointStore,
+        wikibase_id: str,
+        checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+    ):
+        self.store = store
+        self.wikibase_id = wikibase_id
+        self.checkpoint_every = checkpoint_every
+        self._pending: dict[str, dict[str, str]] = {}
+        self._n_chunks: dict[str, int] = {}
+
+    @property
+    def prefix(self) -> str:
+        """The prefix under which this concept's checkpoints are stored."""
+        return f"{CHECKPOINT_PREFIX}/{self.wikibase_id}"
+
+    @staticmethod
+    def fingerprint(*inputs: str) -> str:
+        """Get a fingerprint of the inputs which determine a concept's selection."""
+        return hashlib.sha256("\n".join(inputs).encode("utf-8")).hexdigest()
+
+    def save_selection(
+        self, fingerprint: str, index: np.ndarray, similarity: np.ndarray
+    ) -> None:
+        """Save the dataset index and similarity of the selected passages."""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            fingerprint=np.array(fingerprint),
+            index=index,
+            similarity=similarity,
+        )
+        self.store.write(f"{self.prefix}/selection.npz", buffer.getvalue())
+
+    def load_selection(self, fingerprint: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """Load the saved selection, if there is one matching the fingerprint."""
+        data = self.store.read(f"{self.prefix}/selection.npz")
+        if data is None:
+            return None
+        with np.load(io.BytesIO(data)) as selection:
+            if str(selection["fingerprint"]) != fingerprint:
+                return None
+            return selection["index"], selection["similarity"]
+
+    def add_prediction(self, classifier_id: str, text: str, spans: list[Span]) -> None:
+        """
+        Record a classifier's prediction for a passage.
+
+        Pending predictions are written to a new checkpoint chunk every
+        `checkpoint_every` predictions.
+        """
+        pending = self._pending.setdefault(classifier_id, {})
+        pending[hash_text(text)] = compact_spans(spans)
+        if len(pending) >= self.checkpoint_every:
+            self.flush(classifier_id)
+
+    def flush(self, classifier_id: str) -> None:
+        """Write any pending predictions for a classifier to a checkpoint chunk."""
+        pending = self._pending.pop(classifier_id, {})
+        if not pending:
+            return
+        chunk_number = self._n_chunks.get(classifier_id, 0)
+        # The pending spans are already JSON, so they're written out as they are
+        chunk = "{%s}" % ",".join(
+            f"{json.dumps(text_hash)}:{spans}" for text_hash, spans in pending.items()
+        )
+        self.store.write(
+            f"{self.prefix}/{classifier_id}/predictions-{chunk_number:05d}.json.gz",
+            gzip.compress(chunk.encode("utf-8")),
+        )
+        self._n_chunks[classifier_id] = chunk_number + 1
+
+    def load_predictions(self, classifier_id: str) -> "CheckpointedPredictions":
+        """Load every checkpointed prediction for a classifier."""
+        keys = self.store.list(f"{self.prefix}/{classifier_id}")
+        predictions: dict[str, str] = {}
+        for key in keys:
+            data = self.store.read(key)
+            if data is not None:
+                predictions.update(
+                    (text_hash, json.dumps(spans, separators=(",", ":")))
+                    for text_hash, spans in json.loads(gzip.decompress(data)).items()
+                )
+        # Carry on numbering chunks from where the previous run left off
+        self._n_chunks[classifier_id] = len(keys)
+        return CheckpointedPredictions(predictions)
+
+    def clear(self) -> None:
+        """Delete all of this concept's checkpoints."""
+        self._pending.clear()
+        self._n_chunks.clear()
+        self.store.delete(self.prefix)
+
+
+class CheckpointedPredictions:
+    """Predictions loaded from a checkpoint, keyed on passage text."""
+
+    def __init__(self, predictions: dict[str, str]):
+        self._predictions = predictions
+
+    def __len__(self) -> int:
+        """The number of passages with checkpointed predictions."""
+        return len(self._predictions)
+
+    def get(self, text: str) -> list[Span] | None:
+        """Get the checkpointed spans for a passage, if there are any."""
+        compact = self._predictions.get(hash_text(text))
+        return None if compact is None else expand_spans(text, compact)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Iterator
+
+import knowledge_graph.classifier as classifier_types
+from knowledge_graph.classifier import Classifier, ClassifierFactory
+from knowledge_graph.concept import Concept
+from knowledge_graph.identifiers import WikibaseID
+from passage_selection import (
+    SelectionStrategy,
+    ThresholdSelection,
+    parse_selection_strategy,
+)
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class ClassifierSpec(BaseModel):
+    """
+    A classifier to run on a concept's selected passages.
+
+    The `default` type is whichever classifier the ClassifierFactory picks for the
+    concept. Any other type is the name of a classifier class in
+    `knowledge_graph.classifier`, which is created with the concept and `params`.
+    """
+
+    type: str = "default"
+    params: dict[str, Any] = Field(default_factory=dict)
+
+    def create(self, concept: Concept) -> Classifier:
+        """Create the classifier for a concept."""
+        if self.type == "default":
+            return ClassifierFactory.create(concept)
+        classifier_class = getattr(classifier_types, self.type, None)
+        if not isinstance(classifier_class, type) or not issubclass(
+            classifier_class, Classifier
+        ):
+            raise ValueError(f"Unknown classifier type: {self.type}")
+        try:
+            return classifier_class(concept, **self.params)
+        except TypeError as e:
+            raise ValueError(f"Invalid params for {self.type}: {str(e)}") from e
+
+
+# The number of classifiers a long-lived worker keeps in memory between requests
+DEFAULT_MAX_CACHED_CLASSIFIERS = 8
+
+
+class ClassifierCache:
+    """
+    The most recently used classifiers, so that they aren't recreated each time.
+
+    Classifiers are keyed on the full definition of their concept as well as their
+    spec, so when a concept is edited in Wikibase, its next request creates a fresh
+    classifier rather than reusing the stale one.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_CACHED_CLASSIFIERS):
+        self.max_size = max_size
+        self.n_hits = 0
+        self.n_misses = 0
+        self._classifiers: OrderedDict[str, Classifier] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """The number of classifiers in the cache."""
+        return len(self._classifiers)
+
+    def get(self, concept: Concept, classifier_spec: ClassifierSpec) -> Classifier:
+        """Get the classifier for a concept, creating it if it isn't cached."""
+        key = f"{concept.model_dump_json()}\n{classifier_spec.model_dump_json()}"
+        with self._lock:
+            classifier = self._classifiers.get(key)
+            if classifier is not None:
+                self._classifiers.move_to_end(key)
+                self.n_hits += 1
+                return classifier
+        classifier = classifier_spec.create(concept)
+        with self._lock:
+            self.n_misses += 1
+            self._classifiers[key] = classifier
+            while len(self._classifiers) > self.max_size:
+                self._classifiers.popitem(last=False)
+        return classifier
+
+
+def iter_classifiers(
+    concept: Concept,
+    classifier_specs: list[ClassifierSpec],
+    classifier_cache: ClassifierCache | None = None,
+) -> Iterator[Classifier]:
+    """
+    Create the classifiers for a concept one at a time, skipping any duplicates.
+
+    Each classifier is only created once the previous one has been used, and the
+    generator doesn't hold on to it afterwards, so only one classifier (and its
+    model) needs to be in memory at a time. If a cache is given, classifiers are
+    reused from it where possible.
+    """
+    seen_ids: set[str] = set()
+    for classifier_spec in classifier_specs:
+        classifier = (
+            classifier_cache.get(concept, classifier_spec)
+            if classifier_cache is not None
+            else classifier_spec.create(concept)
+        )
+        if classifier.id in seen_ids:
+            continue
+        seen_ids.add(classifier.id)
+        yield classifier
+        del classifier
+
+
+def parse_classifier_specs(config: list | None = None) -> list[ClassifierSpec]:
+    """
+    Parse the classifiers for a concept from its entry in concepts.yml.
+
+    Each classifier can either be a plain type, or a mapping with a `type` and
+    optional `params`. Defaults to the ClassifierFactory's classifier.
+    """
+    if not config:
+        return [ClassifierSpec()]
+    if not isinstance(config, list):
+        raise ValueError(f"Classifiers should be a list, not {config!r}")
+    return [
+        ClassifierSpec.model_validate(entry)
+        if isinstance(entry, dict)
+        else ClassifierSpec(type=str(entry))
+        for entry in config
+    ]
+
+
+class ConceptConfig(BaseModel):
+    """How inference should be run for a single concept."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    wikibase_id: WikibaseID
+    selection: SelectionStrategy = Field(default_factory=ThresholdSelection)
+    classifiers: list[ClassifierSpec] = Field(
+        default_factory=lambda: [ClassifierSpec()]
+    )
+
+    def fingerprint(self) -> str:
+        """Get a hash of how the concept is processed, ignoring its id."""
+        config = {
+            "selection": self.selection.model_dump(mode="json"),
+            "classifiers": [spec.model_dump(mode="json") for spec in self.classifiers],
+        }
+        return hashlib.sha256(
+            json.dumps(config, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+
+def parse_concepts_config(config: list) -> list[ConceptConfig]:
+    """
+    Parse the contents of concepts.yml into a config for each concept.
+
+    Each entry in the file can either be a plain Wikibase ID, or a mapping with an
+    `id` (or `wikibase_id`), an optional `selection` strategy and an optional list
+    of `classifiers` to run over the selected passages, eg
+
+    ```yaml
+    - Q123
+    - id: Q456
+      selection:
+        strategy: stratified
+        max_passages: 5000
+      classifiers:
+        - default
+        - type: EmbeddingClassifier
+          params:
+            threshold: 0.7
+    ```
+    """
+    if not isinstance(config, list):
+        raise ValueError("The config file should contain a list of concepts")
+
+    concept_configs = []
+    for entry in config:
+        if isinstance(entry, dict):
+            wikibase_id = entry.get("id") or entry.get("wikibase_id")
+            if not wikibase_id:
+                raise ValueError(f"Concept in config is missing an id: {entry}")
+            selection = parse_selection_strategy(entry.get("selection"))
+            classifiers = parse_classifier_specs(entry.get("classifiers"))
+        else:
+            wikibase_id = entry
+            selection = parse_selection_strategy()
+            classifiers = parse_classifier_specs()
+        concept_configs.append(
+            ConceptConfig(
+                wikibase_id=WikibaseID(wikibase_id),
+                selection=selection,
+                classifiers=classifiers,
+            )
+        )
+
+    return sorted(concept_configs, key=lambda c: c.wikibase_id)
@@ -0,0 +1,152 @@
+import heapq
+import json
+import statistics
+from datetime import datetime
+from typing import Callable
+
+from botocore.exceptions import ClientError
+from mypy_boto3_s3 import S3Client
+from pydantic import BaseModel, Field
+
+COST_MODEL_KEY = "concept_costs.json"
+
+# Used to estimate the cost of concepts before we've seen any of them
+DEFAULT_SECONDS_PER_PASSAGE = 0.01
+
+
+class ConceptCost(BaseModel):
+    """The measured cost of processing a concept in a previous run."""
+
+    n_passages: int
+    # Each of the concept's classifiers is run over every one of its passages
+    n_classifiers: int = 1
+    predict_seconds: float
+    total_seconds: float
+    # A fingerprint of the concept's config (its selection strategy and
+    # classifiers) when the cost was measured
+    config_fingerprint: str = ""
+    # The types of classifier the concept's classifiers turned out to be, eg which
+    # classifier the ClassifierFactory picked for it
+    classifier_types: list[str] = Field(default_factory=list)
+    updated_at: str
+
+    @property
+    def seconds_per_passage(self) -> float:
+        """The time taken for each classifier to process each passage."""
+        return self.total_seconds / max(self.n_passages * self.n_classifiers, 1)
+
+
+class CostModel:
+    """
+    Estimates how long each concept will take to process, based on previous runs.
+
+    The costs of each concept's most recent successful run are stored in S3, in
+    `concept_costs.json`. Concepts which haven't been processed before are
+    estimated from the number of passages we expect to select for them and their
+    number of classifiers, at the median cost per passage per classifier of the
+    concepts we have seen. If a concept's config has changed since its cost was
+    measured, its cost is rescaled in the same way, at its own measured rate.
+    """
+
+    def __init__(self, costs: dict[str, ConceptCost] | None = None):
+        self.costs = costs or {}
+
+    @classmethod
+    def load(cls, s3_client: S3Client, bucket_name: str) -> "CostModel":
+        """Load the costs from previous runs from S3."""
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=COST_MODEL_KEY)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return cls()
+            raise
+        costs = json.loads(response["Body"].read())
+        return cls(
+            {
+                wikibase_id: ConceptCost.model_validate(cost)
+                for wikibase_id, cost in costs.items()
+            }
+        )
+
+    def save(self, s3_client: S3Client, bucket_name: str) -> None:
+        """Store the costs in S3, for use in future runs."""
+        costs = {
+            wikibase_id: cost.model_dump() for wikibase_id, cost in self.costs.items()
+        }
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=COST_MODEL_KEY,
+            Body=json.dumps(costs, indent=2, sort_keys=True).encode("utf-8"),
+        )
+
+    def record(
+        self,
+        wikibase_id: str,
+        n_passages: int,
+        n_classifiers: int,
+        predict_seconds: float,
+        total_seconds: float,
+        config_fingerprint: str,
+        classifier_types: list[str],
+    ) -> None:
+        """Record the measured cost of processing a concept."""
+        self.costs[wikibase_id] = ConceptCost(
+            n_passages=n_passages,
+            n_classifiers=n_classifiers,
+            predict_seconds=predict_seconds,
+            total_seconds=total_seconds,
+            config_fingerprint=config_fingerprint,
+            classifier_types=classifier_types,
+            updated_at=datetime.now().isoformat(timespec="seconds"),
+        )
+
+    def classifier_types(self, wikibase_id: str) -> list[str]:
+        """Get the types of classifier a concept produced in its last run, if any."""
+        cost = self.costs.get(wikibase_id)
+        return cost.classifier_types if cost is not None else []
+
+    @property
+    def seconds_per_passage(self) -> float:
+        """The median time taken per passage per classifier in previous runs."""
+        rates = [
+            cost.seconds_per_passage
+            for cost in self.costs.values()
+            if cost.n_passages > 0
+        ]
+        return statistics.median(rates) if rates else DEFAULT_SECONDS_PER_PASSAGE
+
+    def estimate(
+        self,
+        wikibase_id: str,
+        config_fingerprint: str,
+        n_classifiers: int,
+        estimate_n_passages: Callable[[], int],
+    ) -> float:
+        """
+        Estimate how many seconds it will take to process a concept.
+
+        `estimate_n_passages` is only called for concepts which haven't been
+        processed before with the same config.
+        """
+        cost = self.costs.get(wikibase_id)
+        if cost is not None and cost.config_fingerprint == config_fingerprint:
+            return cost.total_seconds
+        seconds_per_passage = (
+            cost.seconds_per_passage
+            if cost is not None and cost.n_passages > 0
+            else self.seconds_per_passage
+        )
+        return estimate_n_passages() * n_classifiers * seconds_per_passage
+
+
+def predict_makespan(costs: list[float], concurrency: int) -> float:
+    """
+    Predict the time to process every concept, submitted in the given order.
+
+    Each task starts on whichever worker becomes free first, so this simulates the
+    list scheduling done by the task runner.
+    """
+    workers = [0.0] * max(concurrency, 1)
+    for cost in costs:
+        heapq.heapreplace(workers, workers[0] + cost)
+    return max(workers)
@@ -0,0 +1,177 @@
+import hashlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pandas.core.util.hashing import hash_pandas_object
+from prefect.logging import get_logger
+from sentence_transformers import SentenceTransformer
+
+logger = get_logger(__name__)
+
+# The version of the embeddings metadata format. Version 1 metadata (with no
+# passage ids) was aligned with the dataset by position.
+EMBEDDINGS_METADATA_VERSION = 2
+
+# The number of new passages to encode at a time
+DEFAULT_ENCODE_CHUNK_SIZE = 10_000
+
+
+def passage_ids(passages: pd.DataFrame) -> np.ndarray:
+    """
+    Get an id for each passage in the dataset, which the embeddings are keyed on.
+
+    Text block ids are only unique within a document, so they're combined with the
+    document id.
+    """
+    ids = (
+        passages["document_id"].astype(str)
+        + ":"
+        + passages["text_block.text_block_id"].astype(str)
+    ).to_numpy(dtype=object)
+    if len(pd.unique(ids)) != len(ids):
+        raise ValueError("The passages dataset contains duplicate passage ids")
+    return ids
+
+
+def passages_fingerprint(passages: pd.DataFrame) -> str:
+    """
+    Get a hash of the passages' ids, and the index labels they're stored under.
+
+    The hash changes if passages are added, removed or reordered, even if the number
+    of passages stays the same.
+    """
+    hashes = hash_pandas_object(
+        passages[["document_id", "text_block.text_block_id"]].astype(str), index=True
+    )
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+
+def align_embeddings(
+    passages: pd.DataFrame, embeddings: np.ndarray, metadata: dict
+) -> np.ndarray:
+    """
+    Get the embeddings for each passage in the dataset, in the dataset's order.
+
+    Embeddings are matched to passages by id, so they stay aligned even if the
+    dataset has been reordered or added to since they were built.
+    """
+    ids = metadata.get("passage_ids")
+    if ids is None:
+        # Embeddings built before passage ids were recorded can only be aligned
+        # by position
+        if len(embeddings) != len(passages):
+            raise ValueError(
+                f"Mismatch between embeddings ({len(embeddings)}) "
+                f"and dataset ({len(passages)}) lengths"
+            )
+        return embeddings
+
+    if len(ids) != len(embeddings):
+        raise ValueError(
+            f"The embeddings metadata has {len(ids)} passage ids, but there are "
+            f"{len(embeddings)} embeddings"
+        )
+    dataset_ids = passage_ids(passages)
+    if len(ids) == len(dataset_ids) and np.array_equal(ids, dataset_ids):
+        return embeddings
+
+    rows = pd.Index(ids).get_indexer(dataset_ids)
+    n_missing = int((rows < 0).sum())
+    if n_missing:
+        raise ValueError(
+            f"{n_missing} passages in the dataset have no embeddings. Run "
+            "`vibe-checker build-embeddings` to embed them."
+        )
+    return embeddings[rows]
+
+
+def build_embeddings(
+    passages: pd.DataFrame,
+    embedding_model: SentenceTransformer,
+    embedding_model_name: str,
+    existing_embeddings: np.ndarray | None = None,
+    existing_metadata: dict | None = None,
+    chunk_size: int = DEFAULT_ENCODE_CHUNK_SIZE,
+) -> tuple[np.ndarray, dict, int]:
+    """
+    Build the embeddings for every passage, only encoding passages which are new.
+
+    Existing embeddings are reused for passages whose id they were built for, as
+    long as they were built with the same model. Existing embeddings without
+    passage ids are reused by position if there's one for each passage. Embeddings
+    for passages which are no longer in the dataset are dropped.
+
+    Returns the embeddings, in the dataset's order, along with their metadata and
+    the number of passages which were encoded.
+    """
+    dataset_ids = passage_ids(passages)
+    n_passages = len(dataset_ids)
+
+    existing_ids = (existing_metadata or {}).get("passage_ids")
+    existing_model_name = (existing_metadata or {}).get("embedding_model_name")
+    if existing_embeddings is None:
+        logger.info("No existing embeddings, encoding every passage")
+        existing_rows = np.full(n_passages, -1)
+    elif existing_model_name != embedding_model_name:
+        logger.info(
+            f"Existing embeddings were built with {existing_model_name}, not "
+            f"{embedding_model_name}, encoding every passage"
+        )
+        existing_rows = np.full(n_passages, -1)
+    elif existing_ids is None:
+        # Embeddings built before passage ids were recorded are aligned with the
+        # dataset by position (as in align_embeddings), so if the lengths still
+        # match, they're adopted as they are and their ids are recorded
+        if len(existing_embeddings) == n_passages:
+            logger.info(
+                "Existing embeddings have no passage ids, adopting them by position"
+            )
+            existing_rows = np.arange(n_passages)
+        else:
+            logger.info(
+                f"Existing embeddings have no passage ids, and there are "
+                f"{len(existing_embeddings)} of them for {n_passages} passages, so "
+                "they can't be aligned. Encoding every passage"
+            )
+            existing_rows = np.full(n_passages, -1)
+    else:
+        existing_rows = pd.Index(existing_ids).get_indexer(dataset_ids)
+
+    reused = existing_rows >= 0
+    new_positions = np.flatnonzero(~reused)
+    logger.info(
+        f"Reusing embeddings for {int(reused.sum())} passages, and encoding "
+        f"{len(new_positions)} new passages"
+    )
+
+    if existing_embeddings is not None and reused.any():
+        dimension = existing_embeddings.shape[1]
+        dtype = existing_embeddings.dtype
+    else:
+        dimension = embedding_model.get_sentence_embedding_dimension()
+        dtype = np.dtype(np.float32)
+    embeddings = np.empty((n_passages, dimension), dtype=dtype)
+    if reused.any():
+        assert existing_embeddings is not None
+        embeddings[reused] = existing_embeddings[existing_rows[reused]]
+
+    texts = passages["text_block.text"]
+    for start in range(0, len(new_positions), chunk_size):
+        positions = new_positions[start : start + chunk_size]
+        embeddings[positions] = embedding_model.encode(
+            texts.iloc[positions].tolist(), convert_to_numpy=True
+        )
+        logger.info(
+            f"Encoded {start + len(positions)}/{len(new_positions)} new passages"
+        )
+
+    metadata = {
+        "version": EMBEDDINGS_METADATA_VERSION,
+        "embedding_model_name": embedding_model_name,
+        "embedding_dimension": int(dimension),
+        "n_passages": n_passages,
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+        "passage_ids": dataset_ids.tolist(),
+    }
+    return embeddings, metadata, len(new_positions)
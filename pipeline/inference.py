@@ -3,31 +3,104 @@ import json
 import logging
 import os
 import random
+import tempfile
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 import boto3
 import numpy as np
 import pandas as pd
+import torch
 import typer
 import yaml
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from knowledge_graph.classifier import ClassifierFactory
+from catalog import CATALOG_KEY, CatalogEntry, update_catalog
+from checkpoints import (
+    CheckpointedPredictions,
+    ConceptCheckpoint,
+    LocalCheckpointStore,
+    S3CheckpointStore,
+)
+from concepts_config import (
+    DEFAULT_MAX_CACHED_CLASSIFIERS,
+    ClassifierCache,
+    ClassifierSpec,
+    ConceptConfig,
+    iter_classifiers,
+    parse_classifier_specs,
+    parse_concepts_config,
+)
+from cost_model import CostModel, predict_makespan
+from embeddings import (
+    DEFAULT_ENCODE_CHUNK_SIZE,
+    align_embeddings,
+    build_embeddings,
+    passages_fingerprint,
+)
+from keyword_index import PREFILTER_CLASSIFIERS, SharedKeywordIndex, keyword_labels
+from knowledge_graph.classifier import Classifier
+from knowledge_graph.concept import Concept
 from knowledge_graph.identifiers import WikibaseID
 from knowledge_graph.labelled_passage import LabelledPassage
+from knowledge_graph.span import Span
 from knowledge_graph.wikibase import WikibaseSession
 from mypy_boto3_s3 import S3Client
+from passage_selection import (
+    SelectionStrategy,
+    ThresholdSelection,
+    parse_selection_strategy,
+)
+from prediction_cache import PredictionCache
+from predictions import ConceptPredictions
 from prefect import flow, task
-from prefect.artifacts import create_progress_artifact, update_progress_artifact
+from prefect.artifacts import (
+    create_markdown_artifact,
+    create_progress_artifact,
+    update_progress_artifact,
+)
 from prefect.futures import wait
 from prefect.logging import get_logger
+from prefect.runtime import task_run
 from prefect.task_runners import ThreadPoolTaskRunner
+from profiling import Profiler, ProfilerType
+from resources import (
+    MB,
+    MEMORY_HEADROOM,
+    MemoryBudget,
+    MemoryGuard,
+    PeakMemoryTracker,
+    available_cpus,
+    available_memory,
+    current_rss,
+    estimate_classifier_memory,
+    plan_concurrency,
+    submit_with_concurrency_limit,
+)
 from rich.logging import RichHandler
+from s3_io import (
+    DEFAULT_DOWNLOAD_CONCURRENCY,
+    DEFAULT_DOWNLOAD_PART_SIZE,
+    S3MultipartWriter,
+    download_object_to_file,
+    put_object_if_changed,
+)
 from sentence_transformers import SentenceTransformer
+from server import DEFAULT_HOST, DEFAULT_PORT, JSONServer
+from streaming import StreamingPipeline
 
 aws_region = os.getenv("AWS_REGION", "eu-west-1")
 aws_profile = os.getenv("AWS_PROFILE", "labs")
+# Large inputs are downloaded as concurrent byte-range GETs of this size
+s3_download_part_size_mb = int(
+    os.getenv("S3_DOWNLOAD_PART_SIZE_MB", DEFAULT_DOWNLOAD_PART_SIZE // MB)
+)
+s3_download_concurrency = int(
+    os.getenv("S3_DOWNLOAD_CONCURRENCY", DEFAULT_DOWNLOAD_CONCURRENCY)
+)
 
 
 def _get_bucket_name_from_ssm() -> str:
@@ -61,6 +134,20 @@ logging.basicConfig(
 )
 logger = get_logger(__name__)
 
+# The most concept tasks which can run at once. Fewer will run if the container
+# doesn't have enough CPUs or memory for this many.
+MAX_CONCURRENT_CONCEPTS = 10
+
+# Shared between the concept tasks, which reserve memory from it before running
+memory_budget = MemoryBudget()
+
+# Where the outputs of profiling runs are stored
+PROFILES_PREFIX = "profiles"
+
+# The number of passages ruled out by the keyword index which are predicted on
+# anyway, to check that the index hasn't ruled out any matches
+N_KEYWORD_INDEX_CHECKS = 50
+
 
 def get_s3_client() -> S3Client:
     """Get a configured S3 client."""
@@ -68,7 +155,11 @@ def get_s3_client() -> S3Client:
         region_name=aws_region,
         profile_name=aws_profile,
     )
-    return session.client("s3")
+    # Leave enough connections in the pool for every concurrent download
+    return session.client(
+        "s3",
+        config=Config(max_pool_connections=max(10, s3_download_concurrency)),
+    )
 
 
 def get_object_bytes_from_s3(s3_client: S3Client, key: str) -> bytes:
@@ -76,6 +167,18 @@ def get_object_bytes_from_s3(s3_client: S3Client, key: str) -> bytes:
     return s3_client.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
 
 
+def download_object_from_s3(s3_client: S3Client, key: str, path: str | Path) -> None:
+    """Download a large S3 object to a local file, as concurrent ranged GETs."""
+    download_object_to_file(
+        s3_client,
+        BUCKET_NAME,
+        key,
+        path,
+        part_size=s3_download_part_size_mb * MB,
+        concurrency=s3_download_concurrency,
+    )
+
+
 def push_object_bytes_to_s3(s3_client: S3Client, key: str | Path, data: bytes) -> None:
     """Push bytes to S3 object."""
     s3_client.put_object(Bucket=BUCKET_NAME, Key=str(key), Body=data)
@@ -87,13 +190,15 @@ def load_passages_dataset(
 ) -> pd.DataFrame:
     """Load the passages dataset from S3."""
     s3_client = get_s3_client()
-    bytes_from_s3 = get_object_bytes_from_s3(s3_client, passages_dataset_file_name)
-    try:
-        dataset = pd.read_feather(io.BytesIO(bytes_from_s3))
-        if dataset.empty:
-            raise ValueError("The dataset is empty")
-    except Exception as e:
-        raise ValueError("Failed to load dataset") from e
+    with tempfile.TemporaryDirectory() as download_dir:
+        dataset_path = Path(download_dir) / passages_dataset_file_name
+        download_object_from_s3(s3_client, passages_dataset_file_name, dataset_path)
+        try:
+            dataset = pd.read_feather(dataset_path)
+            if dataset.empty:
+                raise ValueError("The dataset is empty")
+        except Exception as e:
+            raise ValueError("Failed to load dataset") from e
 
     # keep only the useful columns
     dataset = dataset[
@@ -154,25 +259,60 @@ def load_passages_dataset(
     return dataset
 
 
+def _to_metadata_string(value: object) -> str:
+    """
+    Convert a single value from the dataset to a string for passage metadata.
+
+    Values are converted in the same way as `str(v)` for each value in
+    `row.to_dict()`, ie with numpy scalars converted to their python equivalents and
+    missing values from nullable columns converted to None.
+    """
+    if value is pd.NA:
+        return str(None)
+    if isinstance(value, (np.number, np.bool_)):
+        return str(value.item())
+    return str(value)
+
+
+_to_metadata_strings = np.frompyfunc(_to_metadata_string, 1, 1)
+
+
+def stringify_passages_metadata(passages: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert every value in a passages dataset to a string, column by column.
+
+    This gives the metadata we attach to each labelled passage. Converting whole
+    columns at once (rather than row by row, for every concept) means that each
+    value only needs to be converted once per run.
+    """
+    return pd.DataFrame(
+        {
+            str(column): _to_metadata_strings(passages[column].to_numpy(dtype=object))
+            for column in passages.columns
+        },
+        index=passages.index,
+    )
+
+
 @task(retries=3, retry_delay_seconds=5)
-def load_wikibase_ids_from_s3(
+def load_concepts_config_from_s3(
     config_file_name: str = "concepts.yml",
-) -> list[WikibaseID]:
-    """Load concept IDs from the configuration file."""
+) -> list[ConceptConfig]:
+    """Load the concepts to run inference on, and their config, from S3."""
     s3_client = get_s3_client()
     bytes_from_s3 = get_object_bytes_from_s3(s3_client, config_file_name)
     try:
         config = yaml.safe_load(bytes_from_s3)
-        wikibase_ids = sorted([WikibaseID(id) for id in config])
+        concept_configs = parse_concepts_config(config)
     except yaml.YAMLError as e:
         raise ValueError(
             "The config file should be valid YAML containing a list of Wikibase IDs"
         ) from e
 
-    if not wikibase_ids:
+    if not concept_configs:
         raise ValueError("No concepts found in the config")
 
-    return wikibase_ids
+    return concept_configs
 
 
 @task(retries=3, retry_delay_seconds=5)
@@ -181,8 +321,10 @@ def load_embeddings(
 ) -> np.ndarray:
     """Load the passages embeddings from S3."""
     s3_client = get_s3_client()
-    bytes_from_s3 = get_object_bytes_from_s3(s3_client, embeddings_file_name)
-    return np.load(io.BytesIO(bytes_from_s3))
+    with tempfile.TemporaryDirectory() as download_dir:
+        embeddings_path = Path(download_dir) / embeddings_file_name
+        download_object_from_s3(s3_client, embeddings_file_name, embeddings_path)
+        return np.load(embeddings_path)
 
 
 @task(retries=3, retry_delay_seconds=5)
@@ -195,20 +337,348 @@ def load_embeddings_metadata(
     return json.load(io.BytesIO(bytes_from_s3))
 
 
+@task(retries=3, retry_delay_seconds=5)
+def save_embeddings(
+    embeddings: np.ndarray,
+    metadata: dict,
+    embeddings_file_name: str = "passages_embeddings.npy",
+    embeddings_metadata_file_name: str = "passages_embeddings_metadata.json",
+) -> None:
+    """
+    Store the passages embeddings and their metadata in S3.
+
+    The embeddings are streamed to S3 in parts, rather than serialised in memory
+    first. The metadata is written last, so that it's only updated once the
+    embeddings it describes are in place.
+    """
+    s3_client = get_s3_client()
+    with S3MultipartWriter(s3_client, BUCKET_NAME, embeddings_file_name) as writer:
+        np.save(writer, embeddings)  # pyright: ignore[reportArgumentType]
+    push_object_bytes_to_s3(
+        s3_client,
+        embeddings_metadata_file_name,
+        json.dumps(metadata).encode("utf-8"),
+    )
+
+
+def _object_exists(s3_client: S3Client, key: str) -> bool:
+    """Check whether an object exists in the bucket."""
+    try:
+        s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return False
+        raise
+    return True
+
+
+def _select_passages(
+    concept: Concept,
+    passages_dataset: pd.DataFrame,
+    passages_embeddings: np.ndarray,
+    embedding_model: SentenceTransformer,
+    selection_strategy: SelectionStrategy,
+) -> pd.DataFrame:
+    """
+    Select passages for inference based on their similarity to the concept.
+
+    Returns the selected rows of the dataset (keeping their index in the dataset),
+    with an additional similarity column.
+    """
+    concept_embedding = embedding_model.encode(concept.to_markdown())
+
+    # Batch compute similarities using pre-computed embeddings
+    passages = passages_dataset["text_block.text"].tolist()
+    logger.info(f"Computing similarities for {len(passages)} passages...")
+
+    # Ensure embeddings and concept embedding have compatible dimensions
+    if len(passages_embeddings) != len(passages_dataset):
+        raise ValueError(
+            f"Mismatch between embeddings ({len(passages_embeddings)}) "
+            f"and dataset ({len(passages_dataset)}) lengths"
+        )
+
+    similarities = passages_embeddings @ concept_embedding  # Shape: (n_passages,)
+
+    # Create a copy of the dataset to avoid modifying the shared DataFrame
+    passages_with_similarity = passages_dataset.copy()
+    passages_with_similarity["similarity"] = similarities
+
+    # Sort by similarity (highest first)
+    passages_with_similarity = passages_with_similarity.sort_values(
+        "similarity", ascending=False
+    )
+
+    logger.info(f"Selecting passages with {selection_strategy!r}")
+    return selection_strategy.select(passages_with_similarity)
+
+
+def _load_stored_classifier_metadata(s3_client: S3Client, key: str) -> dict | None:
+    """Load a classifier's stored classifier.json, or None if it doesn't exist."""
+    try:
+        return json.loads(get_object_bytes_from_s3(s3_client, key))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return None
+        raise
+
+
+def _run_classifier(
+    classifier: Classifier,
+    concept: Concept,
+    wikibase_id: WikibaseID,
+    texts: list[str],
+    metadata_columns: list[str],
+    metadata_values: np.ndarray,
+    output_order: list[int],
+    checkpoint: ConceptCheckpoint,
+    resuming: bool,
+    s3_client: S3Client,
+    on_progress: Callable[[int], None],
+    dataset_rows: Optional[np.ndarray] = None,
+    keyword_index: Optional[SharedKeywordIndex] = None,
+    output_root: Optional[str] = None,
+    use_prediction_cache: bool = True,
+) -> dict:
+    """
+    Run a classifier on a concept's selected passages, and store its outputs in S3.
+
+    For keyword classifiers, the `keyword_index` is used to find the passages which
+    could contain one of the concept's labels (given the passages' `dataset_rows`),
+    and only those passages are predicted on. The rest are recorded as having no
+    spans.
+
+    Outputs are stored under `{output_root}/{wikibase_id}/{classifier_id}` if
+    there's an `output_root`. Without the prediction cache, every passage is
+    predicted on afresh (eg for profiling).
+
+    Returns the classifier's part of the concept's result.
+    """
+    classifier_metadata = {
+        "id": classifier.id,
+        "name": str(classifier),
+        "date": datetime.now().date().isoformat(),
+    }
+
+    if use_prediction_cache:
+        prediction_cache = PredictionCache.load(s3_client, BUCKET_NAME, classifier.id)
+        logger.info(
+            f"Loaded {len(prediction_cache)} cached predictions for {classifier}"
+        )
+    else:
+        prediction_cache = PredictionCache(classifier.id)
+    checkpointed_predictions = (
+        checkpoint.load_predictions(classifier.id)
+        if resuming
+        else CheckpointedPredictions({})
+    )
+    if resuming:
+        logger.info(
+            f"Resumed {len(checkpointed_predictions)} predictions for {classifier} "
+            "from the last checkpoint"
+        )
+
+    n_passages = len(texts)
+    output_prefix = Path(output_root or "") / wikibase_id / classifier.id
+    logger.info(f"Outputs will be stored in s3://{BUCKET_NAME}/{output_prefix}")
+
+    def encode_labelled_passage(position: int) -> bytes:
+        labelled_passage = LabelledPassage(
+            text=texts[position],
+            spans=predictions.spans(position, texts[position]),
+            metadata=dict(zip(metadata_columns, metadata_values[position])),
+        )
+        record = {
+            "marked_up_text": labelled_passage.get_highlighted_text(
+                start_pattern='<span class="prediction-highlight">',
+                end_pattern="</span>",
+            ),
+            **json.loads(labelled_passage.model_dump_json()),
+        }
+        return json.dumps(record).encode("utf-8")
+
+    def predict(text: str) -> list[Span]:
+        predicted_spans = prediction_cache.get(text)
+        if predicted_spans is None:
+            predicted_spans = checkpointed_predictions.get(text)
+            if predicted_spans is None:
+                predicted_spans = classifier.predict(text)
+                checkpoint.add_prediction(classifier.id, text, predicted_spans)
+            prediction_cache.put(text, predicted_spans)
+        return predicted_spans
+
+    def predict_no_spans(text: str) -> list[Span]:
+        return []
+
+    candidates = None
+    if keyword_index is not None and dataset_rows is not None:
+        candidates = _keyword_candidates(classifier, texts, dataset_rows, keyword_index)
+
+    def write_line(line: bytes) -> None:
+        if predictions_writer.bytes_written:
+            predictions_writer.write(b"\n")
+        predictions_writer.write(line)
+
+    # Run inference for the concept. Predicting, encoding the outputs and
+    # uploading them to S3 run concurrently, as a pipeline of stages connected
+    # by bounded queues.
+    predict_start = time.perf_counter()
+    logger.info(
+        f"Running inference for {classifier} on {n_passages} passages, and "
+        f"streaming predictions to S3: {output_prefix / 'predictions.jsonl'}"
+    )
+    # The same text often appears in several passages (eg boilerplate which is
+    # repeated across documents), so we only need to predict on each text once.
+    # The spans are held in compact arrays, and only turned back into objects as
+    # each passage's output is encoded.
+    predictions = ConceptPredictions(n_passages)
+    n_positive_passages = 0
+    with (
+        S3MultipartWriter(
+            s3_client=s3_client,
+            bucket_name=BUCKET_NAME,
+            key=str(output_prefix / "predictions.jsonl"),
+            skip_unchanged=True,
+        ) as predictions_writer,
+        StreamingPipeline(encode_labelled_passage, write_line) as pipeline,
+    ):
+        for passage_num, position in enumerate(output_order, start=1):
+            can_match = candidates is None or candidates[position]
+            if predictions.record(
+                position, texts[position], predict if can_match else predict_no_spans
+            ):
+                n_positive_passages += 1
+            pipeline.put(position)
+            on_progress(passage_num)
+
+        # Make sure the predictions are stored before we finish the upload, in
+        # case the task is interrupted
+        checkpoint.flush(classifier.id)
+        # Measured before the cache is saved, as saving evicts old entries
+        prediction_cache_nbytes = prediction_cache.nbytes
+        if use_prediction_cache:
+            prediction_cache.save(s3_client, BUCKET_NAME)
+
+    predict_seconds = time.perf_counter() - predict_start
+    n_unique_passages = len(predictions)
+    logger.info(
+        f"Generated {n_passages} labelled passages, from {n_unique_passages} "
+        f"unique passages. Served {prediction_cache.hits}/{n_unique_passages} "
+        f"predictions from the cache ({prediction_cache.hit_rate:.1%} hit rate). "
+        f"Held {predictions.n_spans} spans in {predictions.nbytes / MB:.1f}MB, "
+        f"alongside {len(prediction_cache)} cached predictions in "
+        f"{prediction_cache_nbytes / MB:.1f}MB"
+    )
+
+    # Outputs which are identical to the stored ones aren't uploaded again, so
+    # that their ETags don't change and downstream caches stay valid
+    bytes_uploaded, bytes_skipped = 0, 0
+    if predictions_writer.skipped:
+        bytes_skipped += predictions_writer.bytes_written
+        # The predictions haven't changed since they were stored, so neither has
+        # the classifier's metadata: keep the date they were first produced on
+        stored_metadata = _load_stored_classifier_metadata(
+            s3_client, str(output_prefix / "classifier.json")
+        )
+        if stored_metadata is not None and all(
+            stored_metadata.get(field) == classifier_metadata[field]
+            for field in ("id", "name")
+        ):
+            classifier_metadata["date"] = stored_metadata.get(
+                "date", classifier_metadata["date"]
+            )
+    else:
+        bytes_uploaded += predictions_writer.bytes_written
+    for file_name, data in [
+        ("concept.json", concept.model_dump_json().encode("utf-8")),
+        ("classifier.json", json.dumps(classifier_metadata).encode("utf-8")),
+    ]:
+        logger.info(f"Pushing {file_name} to S3: {output_prefix / file_name}")
+        if put_object_if_changed(
+            s3_client, BUCKET_NAME, str(output_prefix / file_name), data
+        ):
+            bytes_uploaded += len(data)
+        else:
+            bytes_skipped += len(data)
+    logger.info(
+        f"Uploaded {bytes_uploaded / MB:.1f}MB of outputs for {classifier}, and "
+        f"skipped {bytes_skipped / MB:.1f}MB which hadn't changed"
+    )
+
+    percentage = (n_positive_passages / n_passages) * 100 if n_passages else 0.0
+    return {
+        "classifier_id": classifier.id,
+        "classifier_name": classifier_metadata["name"],
+        "classifier_type": type(classifier).__name__,
+        "date": classifier_metadata["date"],
+        "n_passages": n_passages,
+        "n_positive_passages": n_positive_passages,
+        "percentage": percentage,
+        "n_unique_passages": n_unique_passages,
+        "cache_hit_rate": prediction_cache.hit_rate,
+        "predict_seconds": predict_seconds,
+        "output_prefix": str(output_prefix),
+        "bytes_uploaded": bytes_uploaded,
+        "bytes_skipped": bytes_skipped,
+    }
+
+
 @task(retries=2, retry_delay_seconds=10)
 def process_single_concept(
     wikibase_id: WikibaseID,
     passages_dataset: pd.DataFrame,
     passages_embeddings: np.ndarray,
+    passages_metadata: pd.DataFrame,
     embedding_model: SentenceTransformer,
-) -> dict:
+    selection_strategy: SelectionStrategy,
+    classifier_specs: Optional[list[ClassifierSpec]] = None,
+    resume: bool = False,
+    checkpoint_dir: Optional[str] = None,
+    intra_op_threads: Optional[int] = None,
+    keyword_index: Optional[SharedKeywordIndex] = None,
+    max_passages: Optional[int] = None,
+    output_root: Optional[str] = None,
+    use_prediction_cache: bool = True,
+    classifier_cache: Optional[ClassifierCache] = None,
+    previous_classifier_types: Optional[list[str]] = None,
+) -> list[dict]:
     """
     Process inference for a single concept.
 
+    Passages are selected for inference by comparing their embeddings to the
+    concept's, using the concept's selection strategy. Each of the concept's
+    classifiers is then run over the same selected passages, storing its outputs
+    under its own prefix, so the selection is only done once however many
+    classifiers there are.
+
+    The selected passages and the classifiers' predictions are checkpointed as we
+    go, either to S3 or to a local `checkpoint_dir`. If `resume` is set (or the
+    task is being retried), inference continues from the last checkpoint rather
+    than starting from scratch.
+
+    The task waits for enough memory to be free in the shared memory budget before
+    selecting passages and running the classifiers (estimating the size of any
+    `default` classifier from the `previous_classifier_types` which the concept
+    produced in its last run), and limits torch to
+    `intra_op_threads` threads so that concurrent tasks don't oversubscribe the CPUs.
+    The task's peak memory (how far the process's RSS rose above its level when the
+    task started) is reported in its results.
+
+    `max_passages` caps the number of selected passages which are processed (eg to
+    profile a concept quickly), and `output_root` and `use_prediction_cache` are
+    passed on to each classifier's run. If a `classifier_cache` is given, the
+    concept's classifiers are reused from it rather than created afresh.
+
     This task is designed to be isolated - if it fails, it won't affect the other
     concept processing tasks.
+
+    Returns a result for each of the concept's classifiers.
     """
+    memory_tracker = PeakMemoryTracker()
+    memory_tracker.start()
     s3_client = get_s3_client()
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
     try:
         # Create progress artifact for this concept
         progress_id = create_progress_artifact(
@@ -221,219 +691,369 @@ def process_single_concept(
         concept = wikibase.get_concept(wikibase_id)
         logger.info(f"Loaded concept: {concept}")
 
-        concept_embedding = embedding_model.encode(concept.to_markdown())
-
-        # Batch compute similarities using pre-computed embeddings
-        passages = passages_dataset["text_block.text"].tolist()
-        logger.info(f"Computing similarities for {len(passages)} passages...")
-
-        # Ensure embeddings and concept embedding have compatible dimensions
-        if len(passages_embeddings) != len(passages_dataset):
-            raise ValueError(
-                f"Mismatch between embeddings ({len(passages_embeddings)}) "
-                f"and dataset ({len(passages_dataset)}) lengths"
+        # Wait until there's enough memory for this concept's copy of the dataset
+        # and its classifiers before doing any of the memory-heavy work, including
+        # loading the classifiers' models. Each classifier is only created when
+        # it's run, and released before the next, so we only need room for the
+        # biggest.
+        classifier_specs = classifier_specs or [ClassifierSpec()]
+        task_memory = _estimate_task_memory(
+            passages_dataset, classifier_specs, previous_classifier_types
+        )
+        logger.info(f"Reserving {task_memory / MB:.0f}MB of memory for {wikibase_id}")
+        with memory_budget.reserve(task_memory):
+            # The concept's cost is timed from here, so that it doesn't include the
+            # time spent waiting for other tasks to release memory
+            work_start = time.perf_counter()
+            checkpoint = ConceptCheckpoint(
+                store=(
+                    LocalCheckpointStore(checkpoint_dir)
+                    if checkpoint_dir
+                    else S3CheckpointStore(s3_client, BUCKET_NAME)
+                ),
+                wikibase_id=wikibase_id,
             )
+            # Prefect retries of this task always resume from the last checkpoint
+            resuming = resume or task_run.run_count > 1
+            if not resuming:
+                checkpoint.clear()
+
+            selection_fingerprint = ConceptCheckpoint.fingerprint(
+                concept.to_markdown(),
+                selection_strategy.model_dump_json(),
+                # The selection is stored as index labels, which are only valid for
+                # the same passages in the same order
+                passages_fingerprint(passages_dataset),
+            )
+            saved_selection = (
+                checkpoint.load_selection(selection_fingerprint) if resuming else None
+            )
+            if saved_selection is not None:
+                selected_index, selected_similarity = saved_selection
+                selected_passages = passages_dataset.loc[selected_index].assign(
+                    similarity=selected_similarity
+                )
+                logger.info("Resumed the selected passages from the last checkpoint")
+            else:
+                selected_passages = _select_passages(
+                    concept=concept,
+                    passages_dataset=passages_dataset,
+                    passages_embeddings=passages_embeddings,
+                    embedding_model=embedding_model,
+                    selection_strategy=selection_strategy,
+                )
+                checkpoint.save_selection(
+                    selection_fingerprint,
+                    index=selected_passages.index.to_numpy(),
+                    similarity=selected_passages["similarity"].to_numpy(),
+                )
 
-        similarities = passages_embeddings @ concept_embedding  # Shape: (n_passages,)
-
-        similarity_threshold = 0.65
-        min_passages = 10_000
-        max_passages = 100_000
+            # Look up the pre-computed metadata strings for the selected passages (using
+            # their index in the shared dataset) before resetting the index
+            selected_metadata = passages_metadata.loc[selected_passages.index]
+            selected_metadata["similarity"] = _to_metadata_strings(
+                selected_passages["similarity"].to_numpy(dtype=object)
+            )
 
-        # Create a copy of the dataset to avoid modifying the shared DataFrame
-        passages_with_similarity = passages_dataset.copy()
-        passages_with_similarity["similarity"] = similarities
+            # Reset index to get sequential integers for progress tracking, keeping
+            # track of where each passage is in the dataset
+            dataset_rows = passages_dataset.index.get_indexer(selected_passages.index)
+            selected_passages = selected_passages.reset_index(drop=True)
+            if max_passages is not None and len(selected_passages) > max_passages:
+                logger.info(f"Only processing the first {max_passages} passages")
+                selected_passages = selected_passages.head(max_passages)
+                selected_metadata = selected_metadata.head(max_passages)
+                dataset_rows = dataset_rows[:max_passages]
+
+            logger.info(f"Selected {len(selected_passages)} passages")
+            if selected_passages.empty:
+                raise ValueError("No passages were selected for inference")
+            max_similarity = max(selected_passages["similarity"])
+            min_similarity = min(selected_passages["similarity"])
+            logger.info(f"Similarity range: {min_similarity:.3f}-{max_similarity:.3f}")
+
+            n_passages = len(selected_passages)
+            texts = [str(text) for text in selected_passages["text_block.text"]]
+            metadata_columns = list(selected_metadata.columns)
+            metadata_values = selected_metadata.to_numpy()
+
+            # The passages are shuffled before they're uploaded. Shuffling the order in
+            # which we process them up front means the outputs can be streamed straight
+            # out in their final order, rather than collected and shuffled at the end.
+            # Every classifier's outputs share the same order, which is seeded from
+            # the selection so that a rerun on the same inputs writes identical
+            # outputs (which then needn't be uploaded again).
+            output_order = list(range(n_passages))
+            random.Random(selection_fingerprint).shuffle(output_order)
+
+            classifier_results = []
+            n_classifiers = len(classifier_specs)
+            for classifier_num, classifier in enumerate(
+                iter_classifiers(concept, classifier_specs, classifier_cache)
+            ):
+                logger.info(f"Created classifier: {classifier}")
+
+                def on_progress(passage_num: int, classifier_num=classifier_num):
+                    # Update progress every 50 passages (or on the last passage)
+                    if passage_num % 50 == 0 or passage_num == n_passages:
+                        progress = (
+                            (classifier_num * n_passages + passage_num)
+                            / (n_classifiers * n_passages)
+                            * 100
+                        )
+                        update_progress_artifact(
+                            progress_id,  # type: ignore
+                            progress=progress,
+                            description=(
+                                f"Classifier {classifier_num + 1}/{n_classifiers}: "
+                                f"processed passage {passage_num}/{n_passages}"
+                            ),
+                        )
+
+                classifier_results.append(
+                    _run_classifier(
+                        classifier=classifier,
+                        concept=concept,
+                        wikibase_id=wikibase_id,
+                        texts=texts,
+                        metadata_columns=metadata_columns,
+                        metadata_values=metadata_values,
+                        output_order=output_order,
+                        checkpoint=checkpoint,
+                        resuming=resuming,
+                        s3_client=s3_client,
+                        on_progress=on_progress,
+                        dataset_rows=dataset_rows,
+                        keyword_index=keyword_index,
+                        output_root=output_root,
+                        use_prediction_cache=use_prediction_cache,
+                    )
+                )
+                # Release the classifier before the next one is created
+                del classifier
+
+            # Now that the outputs are safely stored, we don't need the checkpoints
+            checkpoint.clear()
+
+        total_seconds = time.perf_counter() - work_start
+        results = [
+            {
+                "concept_id": wikibase_id,
+                "preferred_label": concept.preferred_label,
+                **classifier_result,
+                "total_seconds": total_seconds,
+                "peak_memory_mb": memory_tracker.peak_increase / MB,
+                "status": "success",
+            }
+            for classifier_result in classifier_results
+        ]
 
-        # Sort by similarity (highest first)
-        passages_with_similarity = passages_with_similarity.sort_values(
-            "similarity", ascending=False
+        for result in results:
+            logger.info(
+                f"Completed processing {wikibase_id} with {result['classifier_name']} "
+                f"({result['n_positive_passages']}/{n_passages} positive)"
+            )
+        update_progress_artifact(
+            progress_id,  # type: ignore
+            progress=100.0,
+            description="Inference completed successfully",
         )
+        return results
 
-        # Separate the passages which are above and below the threshold similarity to
-        # our concept embedding.
-        above_threshold = passages_with_similarity[
-            passages_with_similarity["similarity"] > similarity_threshold
-        ]
-        below_threshold = passages_with_similarity[
-            passages_with_similarity["similarity"] <= similarity_threshold
+    except (ValueError, RuntimeError, ConnectionError) as e:
+        logger.error(f"Failed to process concept {wikibase_id}: {str(e)}")
+        # Return failure result instead of raising exception
+        # This prevents one concept failure from stopping others
+        return [
+            {
+                "concept_id": wikibase_id,
+                "status": "failed",
+                "error": str(e),
+                "n_passages": len(passages_dataset),
+                "n_positive_passages": 0,
+                "output_prefix": "",
+                "peak_memory_mb": memory_tracker.peak_increase / MB,
+            }
         ]
+    finally:
+        memory_tracker.stop()
 
-        logger.info(
-            f"Found {len(above_threshold)} passages above threshold {similarity_threshold}"
+
+def _keyword_candidates(
+    classifier: Classifier,
+    texts: list[str],
+    dataset_rows: np.ndarray,
+    keyword_index: SharedKeywordIndex,
+) -> np.ndarray | None:
+    """
+    Find the selected passages which a keyword classifier could match.
+
+    Returns a boolean mask over the selected passages, or None if the classifier's
+    predictions can't be narrowed down, in which case every passage is predicted on.
+    """
+    labels = keyword_labels(classifier)
+    if labels is None:
+        return None
+    candidates = keyword_index.get().candidates(labels)
+    if candidates is None:
+        logger.info(f"Can't look up the labels of {classifier} in the keyword index")
+        return None
+    candidates = candidates[dataset_rows]
+
+    # The index should never rule out a passage which the classifier would match,
+    # but check a sample of the ruled out passages to make sure, since the outputs
+    # have to be the same as predicting on every passage
+    ruled_out = np.flatnonzero(~candidates)
+    sample = random.sample(list(ruled_out), min(len(ruled_out), N_KEYWORD_INDEX_CHECKS))
+    if any(classifier.predict(texts[position]) for position in sample):
+        logger.warning(
+            f"The keyword index ruled out passages which {classifier} matches, so "
+            "predicting on every passage instead"
         )
-        logger.info(f"Found {len(below_threshold)} passages below threshold")
-
-        # Selection strategy:
-        # 1. If we have enough above threshold, take all of them, up to max_passages.
-        # 2. If we don't have enough above threshold, take everything which is above
-        #    the threshold, and then supplement the list with the passages which are
-        #    closest to the threshold to reach min_passages.
-        if len(above_threshold) >= min_passages:
-            selected_passages = above_threshold
-        else:
-            # Sort below_threshold by distance from threshold (closest first)
-            below_threshold = (
-                below_threshold.assign(
-                    distance_from_threshold=abs(
-                        below_threshold["similarity"] - similarity_threshold
-                    )
-                )
-                .sort_values("distance_from_threshold")
-                .drop(columns=["distance_from_threshold"])
-            )
-            remaining_needed = min_passages - len(above_threshold)
-            selected_passages = pd.concat(
-                [above_threshold, below_threshold.head(remaining_needed)]
-            )
+        return None
 
-        # Ensure we don't exceed max_passages in either scenario
-        selected_passages = selected_passages.head(max_passages)
+    logger.info(
+        f"The keyword index narrowed {len(candidates)} passages down to "
+        f"{int(candidates.sum())} candidates for {classifier}"
+    )
+    return candidates
 
-        # Reset index to get sequential integers for progress tracking
-        selected_passages = selected_passages.reset_index(drop=True)
 
-        logger.info(f"Selected {len(selected_passages)} passages")
-        max_similarity = max(selected_passages["similarity"])
-        min_similarity = min(selected_passages["similarity"])
-        logger.info(f"Similarity range: {min_similarity:.3f}-{max_similarity:.3f}")
+def _may_use_keyword_index(
+    concept_config: ConceptConfig, previous_classifier_types: list[str]
+) -> bool:
+    """
+    Check whether any of a concept's classifiers could use the keyword index.
 
-        classifier = ClassifierFactory.create(concept)
-        logger.info(f"Created a {classifier}")
+    We don't know which classifier the ClassifierFactory will pick for a `default`
+    classifier until it's been created, so unless we know what it picked in the
+    concept's last run, we assume it could be a keyword classifier.
+    """
+    for classifier_spec in concept_config.classifiers:
+        if classifier_spec.type in PREFILTER_CLASSIFIERS:
+            return True
+        if classifier_spec.type == "default" and (
+            not previous_classifier_types
+            or PREFILTER_CLASSIFIERS.intersection(previous_classifier_types)
+        ):
+            return True
+    return False
+
+
+def _load_keyword_index(
+    s3_client: S3Client, passages_dataset: pd.DataFrame
+) -> SharedKeywordIndex:
+    """Load the keyword index for the passages dataset, building it if necessary."""
+    texts = passages_dataset["text_block.text"]
+    assert isinstance(texts, pd.Series)
+    keyword_index = SharedKeywordIndex(
+        texts=texts,
+        dataset_version=_dataset_version(s3_client),
+        s3_client=s3_client,
+        bucket_name=BUCKET_NAME,
+    )
+    keyword_index.get()
+    return keyword_index
 
-        classifier_metadata = {
-            "id": classifier.id,
-            "name": str(classifier),
-            "date": datetime.now().date().isoformat(),
-        }
 
-        # Run inference for the concept
-        logger.info(f"Running inference for {classifier}")
-        # Calculate total passages for progress tracking
-        n_passages = len(selected_passages)
-
-        labelled_passages: list[LabelledPassage] = []
-        assert isinstance(selected_passages, pd.DataFrame)
-        for idx, (_, row) in enumerate(selected_passages.iterrows()):
-            text = str(row["text_block.text"])
-            predicted_spans = classifier.predict(text)
-            text_block_metadata = {str(k): str(v) for k, v in row.to_dict().items()}
-            labelled_passage = LabelledPassage(
-                text=text,
-                spans=predicted_spans,
-                metadata=text_block_metadata,
-            )
-            labelled_passages.append(labelled_passage)
-
-            # Update progress every 50 passages (or on the last passage)
-            passage_num = idx + 1
-            if passage_num % 50 == 0 or passage_num == n_passages:
-                progress = (passage_num / n_passages) * 100
-                update_progress_artifact(
-                    progress_id,  # type: ignore
-                    progress=progress,
-                    description=f"Processed passage {passage_num}/{n_passages}",
-                )
+def _dataset_version(s3_client: S3Client) -> str:
+    """Get the version of the passages dataset in S3, from its ETag."""
+    response = s3_client.head_object(Bucket=BUCKET_NAME, Key="passages_dataset.feather")
+    return response["ETag"].strip('"')
 
-        logger.info(f"Generated {len(labelled_passages)} labelled passages")
 
-        # before uploading the passages, we should shuffle them
-        random.shuffle(labelled_passages)
+def _estimate_task_memory(
+    passages_dataset: pd.DataFrame,
+    classifier_specs: list[ClassifierSpec],
+    previous_classifier_types: Optional[list[str]] = None,
+) -> int:
+    """
+    Estimate the memory a concept task needs, in bytes.
 
-        output_prefix = Path(wikibase_id) / classifier.id
-        logger.info(f"Outputs will be stored in s3://{BUCKET_NAME}/{output_prefix}")
+    Each task needs its own copy of the dataset, plus room for the biggest of its
+    classifiers, as they're run one at a time. `default` classifiers are estimated
+    from the types of classifier the concept produced in its last run, if any.
+    """
+    return int(passages_dataset.memory_usage(deep=False).sum()) + max(
+        estimate_classifier_memory(classifier_spec.type, previous_classifier_types)
+        for classifier_spec in classifier_specs
+    )
 
-        # Push results for this concept to S3
-        jsonl_string = "\n".join(
-            [
-                json.dumps(
-                    {
-                        "marked_up_text": labelled_passage.get_highlighted_text(
-                            start_pattern='<span class="prediction-highlight">',
-                            end_pattern="</span>",
-                        ),
-                        **json.loads(labelled_passage.model_dump_json()),
-                    }
-                )
-                for labelled_passage in labelled_passages
-            ]
-        )
 
-        logger.info(f"Pushing predictions to S3: {output_prefix / 'predictions.jsonl'}")
-        push_object_bytes_to_s3(
-            s3_client=s3_client,
-            key=output_prefix / "predictions.jsonl",
-            data=jsonl_string.encode("utf-8"),
-        )
+def _estimate_n_selected_passages(
+    concept_config: ConceptConfig,
+    passages_embeddings: np.ndarray,
+    embedding_model: SentenceTransformer,
+) -> int:
+    """
+    Estimate how many passages will be selected for a concept we haven't seen before.
 
-        logger.info(f"Pushing concept data to S3: {output_prefix / 'concept.json'}")
-        push_object_bytes_to_s3(
-            s3_client=s3_client,
-            key=output_prefix / "concept.json",
-            data=concept.model_dump_json().encode("utf-8"),
-        )
+    For the threshold strategy, this depends on how many passages are above the
+    similarity threshold, so we need to fetch and encode the concept. The other
+    strategies always select their budget of passages.
+    """
+    selection = concept_config.selection
+    n_dataset_passages = len(passages_embeddings)
+    if not isinstance(selection, ThresholdSelection):
+        return min(selection.max_passages, n_dataset_passages)
 
-        logger.info(
-            f"Pushing classifier metadata to S3: {output_prefix / 'classifier.json'}"
-        )
-        push_object_bytes_to_s3(
-            s3_client=s3_client,
-            key=output_prefix / "classifier.json",
-            data=json.dumps(classifier_metadata).encode("utf-8"),
+    try:
+        concept = WikibaseSession().get_concept(concept_config.wikibase_id)
+        concept_embedding = embedding_model.encode(concept.to_markdown())
+    except Exception as e:
+        logger.warning(
+            f"Couldn't estimate the cost of {concept_config.wikibase_id}, assuming "
+            f"it will use its maximum number of passages: {str(e)}"
         )
+        return min(selection.max_passages, n_dataset_passages)
 
-        n_positive_passages = sum(1 for passage in labelled_passages if passage.spans)
-        n_passages = len(labelled_passages)
+    similarities = passages_embeddings @ concept_embedding
+    n_above_threshold = int(
+        np.count_nonzero(similarities > selection.similarity_threshold)
+    )
+    return min(
+        max(n_above_threshold, selection.min_passages),
+        selection.max_passages,
+        n_dataset_passages,
+    )
 
-        result = {
-            "concept_id": wikibase_id,
-            "preferred_label": concept.preferred_label,
-            "n_passages": n_passages,
-            "n_positive_passages": n_positive_passages,
-            "output_prefix": str(output_prefix),
-            "status": "success",
-        }
 
-        logger.info(
-            f"Completed processing {wikibase_id} ({n_positive_passages}/{len(labelled_passages)} positive)"
-        )
-        update_progress_artifact(
-            progress_id,  # type: ignore
-            progress=100.0,
-            description="Inference completed successfully",
-        )
-        return result
-
-    except (ValueError, RuntimeError, ConnectionError) as e:
-        logger.error(f"Failed to process concept {wikibase_id}: {str(e)}")
-        # Return failure result instead of raising exception
-        # This prevents one concept failure from stopping others
-        return {
-            "concept_id": wikibase_id,
-            "status": "failed",
-            "error": str(e),
-            "n_passages": len(passages_dataset),
-            "n_positive_passages": 0,
-            "output_prefix": "",
-        }
+def _catalog_entry(result: dict) -> CatalogEntry:
+    """Get the catalog entry for a successfully processed concept."""
+    output_prefix = Path(result["output_prefix"])
+    return CatalogEntry(
+        wikibase_id=str(result["concept_id"]),
+        classifier_id=result["classifier_id"],
+        classifier_name=result["classifier_name"],
+        preferred_label=result["preferred_label"],
+        date=result["date"],
+        n_passages=result["n_passages"],
+        n_positive_passages=result["n_positive_passages"],
+        artifacts={
+            "predictions": str(output_prefix / "predictions.jsonl"),
+            "concept": str(output_prefix / "concept.json"),
+            "classifier": str(output_prefix / "classifier.json"),
+        },
+    )
 
 
-def _run_inference_on_concepts(wikibase_ids: list[WikibaseID]) -> list[dict]:
+def _load_inference_inputs() -> tuple[
+    pd.DataFrame, pd.DataFrame, np.ndarray, SentenceTransformer
+]:
     """
-    Core inference logic: submit tasks for each concept and collect results.
+    Load everything shared by the concept tasks.
 
-    Args:
-        wikibase_ids: List of Wikibase IDs to process
-        passages_dataset: DataFrame of passages
-        passages_embeddings: Pre-computed embeddings
-        embedding_model: SentenceTransformer model instance
-
-    Returns:
-        List of result dicts with keys: concept_id, status, n_passages, etc.
+    Returns the passages dataset, the passages' metadata strings, the passages'
+    embeddings (aligned with the dataset) and the embedding model.
     """
     logger.info("Loading dataset...")
     passages_dataset = load_passages_dataset()
     logger.info(f"Loaded {len(passages_dataset)} passages from the dataset")
 
+    logger.info("Converting passage metadata to strings...")
+    passages_metadata = stringify_passages_metadata(passages_dataset)
+    logger.info("Converted passage metadata to strings")
+
     logger.info("Loading embeddings...")
     passages_embeddings = load_embeddings()
     logger.info(f"Loaded {passages_embeddings.shape[0]} embeddings")
@@ -442,32 +1062,165 @@ def _run_inference_on_concepts(wikibase_ids: list[WikibaseID]) -> list[dict]:
     passages_embeddings_metadata = load_embeddings_metadata()
     logger.info("Loaded embeddings generation metadata")
 
+    # Match the embeddings to the dataset's passages by id, rather than trusting
+    # that they're in the same order
+    passages_embeddings = align_embeddings(
+        passages_dataset, passages_embeddings, passages_embeddings_metadata
+    )
+    logger.info("Aligned the embeddings with the dataset")
+
     logger.info("Loading embedding model...")
     embedding_model_name = passages_embeddings_metadata["embedding_model_name"]
     embedding_model = SentenceTransformer(embedding_model_name)
     logger.info(f"Loaded embedding model: {embedding_model_name}")
 
+    return passages_dataset, passages_metadata, passages_embeddings, embedding_model
+
+
+def _run_inference_on_concepts(
+    concept_configs: list[ConceptConfig],
+    resume: bool = False,
+    checkpoint_dir: Optional[str] = None,
+    memory_limit_mb: Optional[int] = None,
+) -> list[dict]:
+    """
+    Core inference logic: submit tasks for each concept and collect results.
+
+    Args:
+        concept_configs: Config for each of the concepts to process, including the
+            Wikibase ID and the passage selection strategy
+        resume: Whether to resume each concept from its last checkpoint
+        checkpoint_dir: Local directory for checkpoints. Defaults to S3.
+        memory_limit_mb: The most memory the run should use. Defaults to a share of
+            the container's memory.
+
+    Returns:
+        List of result dicts with keys: concept_id, status, n_passages, etc.
+    """
+    passages_dataset, passages_metadata, passages_embeddings, embedding_model = (
+        _load_inference_inputs()
+    )
+
+    # The costs of previous runs tell us how long each concept takes, and which
+    # classifiers the ClassifierFactory picked for it
+    s3_client = get_s3_client()
+    cost_model = CostModel.load(s3_client, BUCKET_NAME)
+
+    # Keyword classifiers only need to predict on passages which contain one of their
+    # labels. The index of the passages' tokens is loaded (or built) now, before any
+    # tasks are running, so that building it doesn't compete with them for memory,
+    # and the memory it holds is accounted for when planning the tasks below.
+    keyword_index = None
+    if any(
+        _may_use_keyword_index(
+            concept_config,
+            cost_model.classifier_types(str(concept_config.wikibase_id)),
+        )
+        for concept_config in concept_configs
+    ):
+        keyword_index = _load_keyword_index(s3_client, passages_dataset)
+
+    # Size the number of concurrent concept tasks to the container's resources,
+    # rather than a fixed number of workers. Each task needs its own copy of the
+    # dataset plus its classifiers, on top of the memory which is already in use,
+    # so we plan for the most demanding of the concepts.
+    n_cpus = available_cpus()
+    task_memory = max(
+        _estimate_task_memory(
+            passages_dataset,
+            concept_config.classifiers,
+            cost_model.classifier_types(str(concept_config.wikibase_id)),
+        )
+        for concept_config in concept_configs
+    )
+    process_memory_limit = (
+        memory_limit_mb * MB
+        if memory_limit_mb
+        else int(available_memory() * MEMORY_HEADROOM)
+    )
+    # Always leave room for at least one task, even if we're already close to the
+    # limit after loading the inputs
+    memory_limit = max(process_memory_limit - current_rss(), task_memory)
+    concurrency = plan_concurrency(
+        max_concurrency=MAX_CONCURRENT_CONCEPTS,
+        n_cpus=n_cpus,
+        memory_budget=memory_limit,
+        task_memory=task_memory,
+    )
+    intra_op_threads = max(1, n_cpus // concurrency)
+    torch.set_num_threads(intra_op_threads)
+    memory_budget.configure(memory_limit)
+    logger.info(
+        f"Running up to {concurrency} concepts at once, with {intra_op_threads} "
+        f"threads each and {memory_limit / MB:.0f}MB of memory between them "
+        f"({n_cpus} CPUs available)"
+    )
+
+    # Submit the concepts which we expect to take longest first, so that a single
+    # expensive concept doesn't hold up the end of the run
+    estimated_costs = {
+        concept_config.wikibase_id: cost_model.estimate(
+            wikibase_id=str(concept_config.wikibase_id),
+            config_fingerprint=concept_config.fingerprint(),
+            n_classifiers=len(concept_config.classifiers),
+            estimate_n_passages=lambda concept_config=concept_config: (
+                _estimate_n_selected_passages(
+                    concept_config, passages_embeddings, embedding_model
+                )
+            ),
+        )
+        for concept_config in concept_configs
+    }
+    concept_configs = sorted(
+        concept_configs,
+        key=lambda concept_config: estimated_costs[concept_config.wikibase_id],
+        reverse=True,
+    )
+    predicted_makespan = predict_makespan(
+        [estimated_costs[c.wikibase_id] for c in concept_configs], concurrency
+    )
+    logger.info(f"Predicted makespan: {predicted_makespan:.0f}s")
+
     # Submit a separate inference task for each of the concepts, and then wait for all
-    logger.info(f"Starting parallel inference of {len(wikibase_ids)} concepts...")
-    concept_futures = []
-    for wikibase_id in wikibase_ids:
-        future = process_single_concept.submit(
-            wikibase_id=wikibase_id,
-            passages_dataset=passages_dataset,
-            passages_embeddings=passages_embeddings,
-            embedding_model=embedding_model,
+    logger.info(f"Starting parallel inference of {len(concept_configs)} concepts...")
+    run_start = time.perf_counter()
+    # Our estimates of each task's memory are rough, so we also keep an eye on the
+    # actual memory use, and hold back new tasks if it gets close to the limit
+    memory_guard = MemoryGuard(limit=process_memory_limit)
+    # Each task reports its own peak, and the process's peak is tracked for the
+    # whole run
+    with PeakMemoryTracker() as run_memory_tracker:
+        concept_futures = submit_with_concurrency_limit(
+            items=concept_configs,
+            submit=lambda concept_config: process_single_concept.submit(
+                wikibase_id=concept_config.wikibase_id,
+                passages_dataset=passages_dataset,
+                passages_embeddings=passages_embeddings,
+                passages_metadata=passages_metadata,
+                embedding_model=embedding_model,
+                selection_strategy=concept_config.selection,
+                classifier_specs=concept_config.classifiers,
+                resume=resume,
+                checkpoint_dir=checkpoint_dir,
+                intra_op_threads=intra_op_threads,
+                keyword_index=keyword_index,
+                previous_classifier_types=cost_model.classifier_types(
+                    str(concept_config.wikibase_id)
+                ),
+            ),
+            concurrency=concurrency,
+            memory_guard=memory_guard,
         )
-        concept_futures.append(future)
 
-    logger.info("Waiting for all concept inference tasks to complete...")
-    wait(concept_futures)
+        logger.info("Waiting for all concept inference tasks to complete...")
+        wait(concept_futures)
+    actual_makespan = time.perf_counter() - run_start
 
     # Track completion and collect results
     collected_results = []
     for future in concept_futures:
         try:
-            result = future.result()
-            collected_results.append(result)
+            collected_results.extend(future.result())
         except (ValueError, RuntimeError) as e:
             logger.error(f"Unexpected error collecting result: {str(e)}")
             # This shouldn't happen with our error handling in process_single_concept
@@ -481,9 +1234,11 @@ def _run_inference_on_concepts(wikibase_ids: list[WikibaseID]) -> list[dict]:
     # Log successful results
     for result in sorted(successful_results, key=lambda x: x["concept_id"]):
         logger.info(
-            f"✓ {result['concept_id']}: "
+            f"✓ {result['concept_id']} ({result['classifier_name']}): "
             f"{result['n_positive_passages']}/{result['n_passages']} "
-            f"({result['percentage']:.2f}%) - {result['output_prefix']}"
+            f"({result['percentage']:.2f}%) - {result['output_prefix']} "
+            f"(cache hit rate {result['cache_hit_rate']:.1%}, "
+            f"peak memory {result['peak_memory_mb']:.0f}MB)"
         )
 
     # Log failed results
@@ -495,36 +1250,108 @@ def _run_inference_on_concepts(wikibase_ids: list[WikibaseID]) -> list[dict]:
             )
 
     logger.info(
-        f"Successfully processed {len(successful_results)}/{len(collected_results)} concepts"
+        f"Successfully processed {len({r['concept_id'] for r in successful_results})}"
+        f"/{len(concept_configs)} concepts, producing {len(successful_results)} "
+        "classifier outputs"
+    )
+    logger.info(
+        f"Makespan: {actual_makespan:.0f}s (predicted {predicted_makespan:.0f}s)"
+    )
+    peak_rss_mb = max(memory_guard.peak, run_memory_tracker.peak) / MB
+    logger.info(
+        f"Peak memory: {peak_rss_mb:.0f}MB of a {process_memory_limit / MB:.0f}MB "
+        "limit. New tasks were paused "
+        f"{memory_guard.n_pauses} times because memory was close to the limit."
+    )
+
+    bytes_uploaded = sum(r["bytes_uploaded"] for r in successful_results)
+    bytes_skipped = sum(r["bytes_skipped"] for r in successful_results)
+    logger.info(
+        f"Uploaded {bytes_uploaded / MB:.1f}MB of outputs, and skipped uploading "
+        f"{bytes_skipped / MB:.1f}MB of outputs which were unchanged"
     )
 
+    # Record the cost of each concept, to order the tasks in future runs. Concepts
+    # with several classifiers have a result for each of them.
+    results_by_concept: dict[str, list[dict]] = {}
+    for result in successful_results:
+        results_by_concept.setdefault(str(result["concept_id"]), []).append(result)
+    concept_configs_by_id = {str(c.wikibase_id): c for c in concept_configs}
+    for wikibase_id, concept_results in results_by_concept.items():
+        cost_model.record(
+            wikibase_id=wikibase_id,
+            n_passages=concept_results[0]["n_passages"],
+            n_classifiers=len(concept_results),
+            predict_seconds=sum(r["predict_seconds"] for r in concept_results),
+            total_seconds=concept_results[0]["total_seconds"],
+            config_fingerprint=concept_configs_by_id[wikibase_id].fingerprint(),
+            classifier_types=[r["classifier_type"] for r in concept_results],
+        )
+    cost_model.save(s3_client, BUCKET_NAME)
+
+    # List the new outputs in the catalog, so that consumers can find them without
+    # listing the whole bucket
+    if successful_results:
+        catalog = update_catalog(
+            s3_client,
+            BUCKET_NAME,
+            [_catalog_entry(result) for result in successful_results],
+        )
+        logger.info(
+            f"Updated {CATALOG_KEY}, which lists {len(catalog.concepts)} concepts"
+        )
+
     return collected_results
 
 
 @flow(  # pyright: ignore[reportCallIssue]
     timeout_seconds=None,
-    task_runner=ThreadPoolTaskRunner(max_workers=10),  # pyright: ignore[reportArgumentType]
+    task_runner=ThreadPoolTaskRunner(max_workers=MAX_CONCURRENT_CONCEPTS),  # pyright: ignore[reportArgumentType]
 )
-def inference_from_config():
+def inference_from_config(
+    resume: bool = False,
+    checkpoint_dir: Optional[str] = None,
+    memory_limit_mb: Optional[int] = None,
+):
     """
     Run inference on all concepts defined in concepts.yml (S3 config).
 
     This is the standard CI path that loads the concept list from the S3 configuration.
 
+    Args:
+        resume: Resume each concept from its last checkpoint, eg after an
+            interrupted run
+        checkpoint_dir: Local directory for checkpoints. Defaults to S3.
+        memory_limit_mb: The most memory the run should use. New concepts are held
+            back when memory gets close to it. Defaults to a share of the
+            container's memory.
+
     Returns:
         List[dict]: Results for each processed concept
     """
-    logger.info("Loading wikibase IDs from config...")
-    wikibase_ids = load_wikibase_ids_from_s3()
-    logger.info(f"Loaded {len(wikibase_ids)} wikibase IDs from the config")
-    return _run_inference_on_concepts(wikibase_ids=wikibase_ids)
+    logger.info("Loading concepts from config...")
+    concept_configs = load_concepts_config_from_s3()
+    logger.info(f"Loaded {len(concept_configs)} concepts from the config")
+    return _run_inference_on_concepts(
+        concept_configs=concept_configs,
+        resume=resume,
+        checkpoint_dir=checkpoint_dir,
+        memory_limit_mb=memory_limit_mb,
+    )
 
 
 @flow(  # pyright: ignore[reportCallIssue]
     timeout_seconds=None,
-    task_runner=ThreadPoolTaskRunner(max_workers=10),  # pyright: ignore[reportArgumentType]
+    task_runner=ThreadPoolTaskRunner(max_workers=MAX_CONCURRENT_CONCEPTS),  # pyright: ignore[reportArgumentType]
 )
-def inference_custom(concept_ids: list[str]):
+def inference_custom(
+    concept_ids: list[str],
+    selection: Optional[SelectionStrategy] = None,
+    classifiers: Optional[list[ClassifierSpec]] = None,
+    resume: bool = False,
+    checkpoint_dir: Optional[str] = None,
+    memory_limit_mb: Optional[int] = None,
+):
     """
     Run inference on specific user-provided concepts.
 
@@ -532,6 +1359,18 @@ def inference_custom(concept_ids: list[str]):
 
     Args:
         concept_ids: List of Wikibase IDs to process (e.g., ["Q69", "Q47"])
+        selection: Passage selection strategy to use for every concept, e.g.
+            {"strategy": "budget", "max_passages": 2000}. Defaults to the
+            threshold strategy.
+        classifiers: Classifiers to run over each concept's selected passages,
+            e.g. [{"type": "default"}, {"type": "KeywordClassifier"}]. Defaults
+            to the ClassifierFactory's classifier for each concept.
+        resume: Resume each concept from its last checkpoint, eg after an
+            interrupted run
+        checkpoint_dir: Local directory for checkpoints. Defaults to S3.
+        memory_limit_mb: The most memory the run should use. New concepts are held
+            back when memory gets close to it. Defaults to a share of the
+            container's memory.
 
     Returns:
         List[dict]: Results for each processed concept
@@ -543,7 +1382,329 @@ def inference_custom(concept_ids: list[str]):
     logger.info(f"Processing requested concepts: {concept_ids}")
     requested_ids = [WikibaseID(id) for id in concept_ids]
     logger.info(f"Processing {len(requested_ids)} requested concept(s)")
-    return _run_inference_on_concepts(wikibase_ids=requested_ids)
+    concept_configs = [
+        ConceptConfig(
+            wikibase_id=wikibase_id,
+            selection=selection or parse_selection_strategy(),
+            classifiers=classifiers or parse_classifier_specs(),
+        )
+        for wikibase_id in requested_ids
+    ]
+    return _run_inference_on_concepts(
+        concept_configs=concept_configs,
+        resume=resume,
+        checkpoint_dir=checkpoint_dir,
+        memory_limit_mb=memory_limit_mb,
+    )
+
+
+@flow(timeout_seconds=None)  # pyright: ignore[reportCallIssue]
+def build_passages_embeddings(
+    embedding_model_name: Optional[str] = None,
+    chunk_size: int = DEFAULT_ENCODE_CHUNK_SIZE,
+) -> dict:
+    """
+    Build the passages embeddings, encoding only passages which haven't been embedded.
+
+    Embeddings are keyed on each passage's document and text block id, so existing
+    embeddings are reused for passages which are still in the dataset, and only new
+    passages are encoded. The stored embeddings are written in the dataset's order,
+    with the passage ids recorded in the metadata.
+
+    Args:
+        embedding_model_name: The sentence-transformers model to encode passages
+            with. Defaults to the model used for the existing embeddings. Changing
+            the model re-encodes every passage.
+        chunk_size: The number of new passages to encode at a time
+
+    Returns:
+        dict: The number of passages, and how many of them were encoded
+    """
+    s3_client = get_s3_client()
+
+    logger.info("Loading dataset...")
+    passages_dataset = load_passages_dataset()
+    logger.info(f"Loaded {len(passages_dataset)} passages from the dataset")
+
+    existing_embeddings = None
+    existing_metadata = None
+    if _object_exists(s3_client, "passages_embeddings_metadata.json"):
+        existing_metadata = load_embeddings_metadata()
+        existing_embeddings = load_embeddings()
+        logger.info(f"Loaded {existing_embeddings.shape[0]} existing embeddings")
+
+    embedding_model_name = embedding_model_name or (existing_metadata or {}).get(
+        "embedding_model_name"
+    )
+    if not embedding_model_name:
+        raise ValueError(
+            "There are no existing embeddings, so an embedding model name is needed"
+        )
+    logger.info(f"Loading embedding model: {embedding_model_name}")
+    embedding_model = SentenceTransformer(embedding_model_name)
+
+    embeddings, metadata, n_encoded = build_embeddings(
+        passages=passages_dataset,
+        embedding_model=embedding_model,
+        embedding_model_name=embedding_model_name,
+        existing_embeddings=existing_embeddings,
+        existing_metadata=existing_metadata,
+        chunk_size=chunk_size,
+    )
+    # Embeddings adopted from a store without passage ids still need to be stored,
+    # so that their ids are recorded
+    if (
+        n_encoded == 0
+        and (existing_metadata or {}).get("passage_ids") == metadata["passage_ids"]
+    ):
+        logger.info("Every passage already has an up to date embedding")
+        return {"n_passages": len(embeddings), "n_encoded": 0}
+
+    logger.info(f"Storing {len(embeddings)} embeddings...")
+    save_embeddings(embeddings, metadata)
+    logger.info(f"Stored embeddings, having encoded {n_encoded} passages")
+    return {"n_passages": len(embeddings), "n_encoded": n_encoded}
+
+
+@flow(timeout_seconds=None)  # pyright: ignore[reportCallIssue]
+def profile_concept(
+    concept_id: str,
+    profiler: ProfilerType = "sampling",
+    trace_memory: bool = False,
+    max_passages: Optional[int] = None,
+    classifiers: Optional[list[ClassifierSpec]] = None,
+    output_dir: Optional[str] = None,
+) -> dict:
+    """
+    Profile inference for a single concept.
+
+    The concept is processed on its own, inside the profiler. Predictions are made
+    afresh rather than served from the prediction cache (though keyword classifiers
+    still only predict on the passages which the keyword index narrows them down
+    to, as in real runs), checkpoints are kept in a temporary directory, and the outputs are stored under `profiles/` rather than
+    replacing the concept's real outputs.
+
+    The profiles are stored in S3 under `profiles/{concept_id}/{timestamp}/` (and
+    in `output_dir`, if given), and the hotspots are published as an artifact.
+
+    Args:
+        concept_id: The Wikibase ID of the concept to profile, e.g. "Q69"
+        profiler: "sampling" to sample the stacks of every thread, or
+            "deterministic" to trace every call with cProfile
+        trace_memory: Also trace memory allocations with tracemalloc
+        max_passages: Only process this many of the selected passages, so that
+            profiling finishes quickly
+        classifiers: Classifiers to profile. Defaults to the ClassifierFactory's
+            classifier for the concept.
+        output_dir: Local directory to save the profiles in, as well as S3
+
+    Returns:
+        dict: The concept's results, and the keys of the profiles in S3
+    """
+    wikibase_id = WikibaseID(concept_id)
+    passages_dataset, passages_metadata, passages_embeddings, embedding_model = (
+        _load_inference_inputs()
+    )
+
+    # Keyword classifiers are profiled on the passages which the keyword index
+    # narrows them down to, as they are in real runs. The index is loaded before
+    # profiling starts, so that loading or building it isn't part of the profile.
+    s3_client = get_s3_client()
+    classifiers = classifiers or [ClassifierSpec()]
+    keyword_index = (
+        _load_keyword_index(s3_client, passages_dataset)
+        if _may_use_keyword_index(
+            ConceptConfig(wikibase_id=wikibase_id, classifiers=classifiers),
+            CostModel.load(s3_client, BUCKET_NAME).classifier_types(str(wikibase_id)),
+        )
+        else None
+    )
+
+    profile_prefix = (
+        Path(PROFILES_PREFIX) / wikibase_id / datetime.now().strftime("%Y%m%dT%H%M%S")
+    )
+    profiled_thread = threading.current_thread()
+    with (
+        tempfile.TemporaryDirectory() as checkpoint_dir,
+        Profiler(
+            profiler=profiler,
+            trace_memory=trace_memory,
+            # Leave out the threads which Prefect and the other tools run in the
+            # background
+            thread_filter=lambda thread: (
+                thread is profiled_thread or thread.name.startswith("pipeline-stage")
+            ),
+        ) as active_profiler,
+    ):
+        results = process_single_concept(
+            wikibase_id=wikibase_id,
+            passages_dataset=passages_dataset,
+            passages_embeddings=passages_embeddings,
+            passages_metadata=passages_metadata,
+            embedding_model=embedding_model,
+            selection_strategy=parse_selection_strategy(),
+            classifier_specs=classifiers,
+            checkpoint_dir=checkpoint_dir,
+            keyword_index=keyword_index,
+            max_passages=max_passages,
+            output_root=str(profile_prefix),
+            use_prediction_cache=False,
+        )
+
+    profile_keys = []
+    for file_name, data in active_profiler.files().items():
+        push_object_bytes_to_s3(s3_client, profile_prefix / file_name, data)
+        profile_keys.append(str(profile_prefix / file_name))
+        if output_dir:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            (Path(output_dir) / file_name).write_bytes(data)
+
+    hotspots = active_profiler.hotspots()
+    create_markdown_artifact(
+        key=f"profile-{wikibase_id}".lower(),
+        markdown="\n\n".join(
+            [
+                f"# Profile of {wikibase_id}",
+                "Profiles: " + ", ".join(f"`{key}`" for key in profile_keys),
+                hotspots,
+            ]
+        ),
+        description=f"Profile of concept {wikibase_id}",
+    )
+    logger.info(f"Stored the profiles in s3://{BUCKET_NAME}/{profile_prefix}")
+    return {"results": results, "profiles": profile_keys, "hotspots": hotspots}
+
+
+def serve_inference(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    max_cached_classifiers: int = DEFAULT_MAX_CACHED_CLASSIFIERS,
+    checkpoint_dir: Optional[str] = None,
+) -> None:
+    """
+    Run a long-lived worker which serves ad-hoc concept inference requests.
+
+    The dataset, embeddings and embedding model are loaded once and kept in memory,
+    along with the keyword index and the most recently used classifiers, so that
+    iterating on a concept doesn't pay the start-up cost of a full run each time.
+
+    Routes:
+        GET /health: The state of the worker
+        POST /infer: Run inference for a concept, with a JSON body like
+            `{"concept_id": "Q69", "selection": {...}, "classifiers": [...],
+            "max_passages": 1000}`, where everything but the concept ID is optional
+        POST /reload: Reload the inputs, eg after the dataset has been updated
+
+    Requests are run one at a time, each with all of the worker's CPUs. Their
+    outputs are stored and catalogued in the same way as the outputs of full runs,
+    but their checkpoints are kept in a temporary directory unless a
+    `checkpoint_dir` is given, rather than in S3.
+    """
+    s3_client = get_s3_client()
+    classifier_cache = ClassifierCache(max_size=max_cached_classifiers)
+    # Requests keep their checkpoints in a private directory by default, so that
+    # they can't clear the checkpoints in S3 of a batch run of the same concept
+    temporary_checkpoint_dir = tempfile.TemporaryDirectory()
+    checkpoint_dir = checkpoint_dir or temporary_checkpoint_dir.name
+    inputs: dict = {}
+    # Only one request runs at a time, and the inputs aren't reloaded mid-request
+    lock = threading.Lock()
+
+    def load_inputs() -> dict:
+        passages_dataset, passages_metadata, passages_embeddings, embedding_model = (
+            _load_inference_inputs()
+        )
+        dataset_version = _dataset_version(s3_client)
+        texts = passages_dataset["text_block.text"]
+        assert isinstance(texts, pd.Series)
+        inputs.update(
+            passages_dataset=passages_dataset,
+            passages_metadata=passages_metadata,
+            passages_embeddings=passages_embeddings,
+            embedding_model=embedding_model,
+            keyword_index=SharedKeywordIndex(
+                texts=texts,
+                dataset_version=dataset_version,
+                s3_client=s3_client,
+                bucket_name=BUCKET_NAME,
+            ),
+            dataset_version=dataset_version,
+        )
+        return health({})
+
+    def health(_: dict) -> dict:
+        return {
+            "status": "ok",
+            "n_passages": len(inputs["passages_dataset"]),
+            "dataset_version": inputs["dataset_version"],
+            "n_cached_classifiers": len(classifier_cache),
+            "classifier_cache_hits": classifier_cache.n_hits,
+            "classifier_cache_misses": classifier_cache.n_misses,
+        }
+
+    def reload(body: dict) -> dict:
+        with lock:
+            logger.info("Reloading the inputs...")
+            return load_inputs()
+
+    def infer(body: dict) -> dict:
+        concept_id = body.get("concept_id")
+        if not concept_id:
+            raise ValueError("The request is missing a concept_id")
+        wikibase_id = WikibaseID(concept_id)
+        selection_strategy = parse_selection_strategy(body.get("selection"))
+        classifier_specs = parse_classifier_specs(body.get("classifiers"))
+        max_passages = body.get("max_passages")
+        if max_passages is not None and (
+            not isinstance(max_passages, int)
+            or isinstance(max_passages, bool)
+            or max_passages < 1
+        ):
+            raise ValueError(
+                f"max_passages should be a positive integer, not {max_passages!r}"
+            )
+        with lock:
+            start = time.perf_counter()
+            results = process_single_concept(
+                wikibase_id=wikibase_id,
+                passages_dataset=inputs["passages_dataset"],
+                passages_embeddings=inputs["passages_embeddings"],
+                passages_metadata=inputs["passages_metadata"],
+                embedding_model=inputs["embedding_model"],
+                selection_strategy=selection_strategy,
+                classifier_specs=classifier_specs,
+                checkpoint_dir=checkpoint_dir,
+                keyword_index=inputs["keyword_index"],
+                max_passages=max_passages,
+                classifier_cache=classifier_cache,
+            )
+            successful_results = [r for r in results if r.get("status") == "success"]
+            if successful_results:
+                update_catalog(
+                    s3_client,
+                    BUCKET_NAME,
+                    [_catalog_entry(result) for result in successful_results],
+                )
+        seconds = time.perf_counter() - start
+        logger.info(f"Processed {wikibase_id} in {seconds:.1f}s")
+        return {"results": results, "seconds": seconds}
+
+    load_inputs()
+    server = JSONServer(
+        routes={
+            ("GET", "/health"): health,
+            ("POST", "/infer"): infer,
+            ("POST", "/reload"): reload,
+        },
+        host=host,
+        port=port,
+    )
+    logger.info(f"Serving inference requests on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        temporary_checkpoint_dir.cleanup()
 
 
 # CLI Interface
@@ -565,6 +1726,54 @@ def run(
             "concept IDs will be loaded from the concepts.yml file in S3."
         ),
     ),
+    strategy: Optional[str] = typer.Option(
+        None,
+        "--strategy",
+        "-s",
+        help=(
+            "Passage selection strategy to use for the specified concepts: "
+            "threshold, stratified or budget. Defaults to threshold."
+        ),
+    ),
+    max_passages: Optional[int] = typer.Option(
+        None,
+        "--max-passages",
+        help=(
+            "Maximum number of passages to run the classifier on for each of the "
+            "specified concepts, ie the compute budget for the selection strategy."
+        ),
+    ),
+    classifier: Optional[list[str]] = typer.Option(
+        None,
+        "--classifier",
+        help=(
+            "Classifier types to run over the specified concepts' selected "
+            "passages, e.g. KeywordClassifier. Can be repeated to compare several "
+            "classifiers on the same passages. 'default' is the ClassifierFactory's "
+            "choice of classifier."
+        ),
+    ),
+    resume: bool = typer.Option(
+        False,
+        "--resume",
+        help=(
+            "Resume an interrupted run, continuing each concept from its last "
+            "checkpoint instead of starting from scratch."
+        ),
+    ),
+    checkpoint_dir: Optional[str] = typer.Option(
+        None,
+        "--checkpoint-dir",
+        help="Local directory to store checkpoints in. Defaults to S3.",
+    ),
+    memory_limit_mb: Optional[int] = typer.Option(
+        None,
+        "--memory-limit-mb",
+        help=(
+            "Most memory the run should use, in MB. New concepts are held back when "
+            "memory gets close to it. Defaults to 80% of the container's memory."
+        ),
+    ),
 ) -> None:
     """
     Run inference on climate policy concepts.
@@ -577,16 +1786,46 @@ def run(
         vibe-checker run                    # CONFIG mode: Run all concepts from config
         vibe-checker run --concept Q69      # CUSTOM mode: Run single concept
         vibe-checker run -c Q69 -c Q47      # CUSTOM mode: Run multiple concepts
+        vibe-checker run -c Q69 -s budget --max-passages 2000
+                                            # CUSTOM mode: Run on a fixed budget
+        vibe-checker run -c Q69 --classifier default --classifier EmbeddingClassifier
+                                            # CUSTOM mode: Compare two classifiers
+        vibe-checker run --resume           # Resume an interrupted run
+
+    In CONFIG mode, the selection strategy and classifiers for each concept are set in
+    concepts.yml.
     """
     try:
         if concept:
             # Custom mode: user-specified concepts
+            selection = None
+            if strategy or max_passages:
+                selection_config: dict = {"strategy": strategy or "threshold"}
+                if max_passages:
+                    selection_config["max_passages"] = max_passages
+                selection = parse_selection_strategy(selection_config)
             typer.echo(f"Running inference for {len(concept)} concept(s)...", err=False)
-            inference_custom(concept_ids=concept)
+            inference_custom(
+                concept_ids=concept,
+                selection=selection,
+                classifiers=parse_classifier_specs(classifier),
+                resume=resume,
+                checkpoint_dir=checkpoint_dir,
+                memory_limit_mb=memory_limit_mb,
+            )
         else:
+            if strategy or max_passages or classifier:
+                raise ValueError(
+                    "--strategy, --max-passages and --classifier can only be used with "
+                    "--concept. Set them for each concept in concepts.yml instead."
+                )
             # Config mode: load from S3 concepts.yml
             typer.echo("Running inference for all concepts from config...", err=False)
-            inference_from_config()
+            inference_from_config(
+                resume=resume,
+                checkpoint_dir=checkpoint_dir,
+                memory_limit_mb=memory_limit_mb,
+            )
         typer.echo("✓ Inference completed successfully", err=False)
     except ValueError as e:
         typer.echo(f"✗ Error: {str(e)}", err=True)
@@ -596,5 +1835,165 @@ def run(
         raise typer.Exit(code=1)
 
 
+@app.command()
+def profile(
+    concept: str = typer.Option(
+        ...,
+        "--concept",
+        "-c",
+        help="Concept ID to profile (e.g., Q69).",
+    ),
+    profiler: str = typer.Option(
+        "sampling",
+        "--profiler",
+        "-p",
+        help=(
+            "sampling (samples every thread, low overhead) or deterministic "
+            "(cProfile, traces every call in the main thread)."
+        ),
+    ),
+    trace_memory: bool = typer.Option(
+        False,
+        "--trace-memory",
+        help="Also trace memory allocations with tracemalloc.",
+    ),
+    max_passages: Optional[int] = typer.Option(
+        None,
+        "--max-passages",
+        help="Only process this many of the selected passages, to finish quickly.",
+    ),
+    classifier: Optional[list[str]] = typer.Option(
+        None,
+        "--classifier",
+        help="Classifier types to profile. Defaults to the concept's default.",
+    ),
+    output_dir: str = typer.Option(
+        "profiles",
+        "--output-dir",
+        "-o",
+        help="Local directory to save the profiles in.",
+    ),
+) -> None:
+    """
+    Profile inference for a single concept.
+
+    Saves flamegraph-compatible profiles (profile.folded for flamegraph.pl or
+    speedscope, or profile.prof for snakeviz) and prints the hotspots.
+
+    Examples:
+        vibe-checker profile --concept Q69 --max-passages 2000
+        vibe-checker profile -c Q69 -p deterministic --trace-memory
+    """
+    try:
+        if profiler not in ("sampling", "deterministic"):
+            raise ValueError(f"Unknown profiler: {profiler}")
+        result = profile_concept(
+            concept_id=concept,
+            profiler=profiler,  # type: ignore[arg-type]
+            trace_memory=trace_memory,
+            max_passages=max_passages,
+            classifiers=parse_classifier_specs(classifier),
+            output_dir=output_dir,
+        )
+        typer.echo(result["hotspots"], err=False)
+        typer.echo(f"✓ Saved the profiles in {output_dir}", err=False)
+    except ValueError as e:
+        typer.echo(f"✗ Error: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+    except Exception as e:
+        typer.echo(f"✗ Unexpected error: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def serve(
+    host: str = typer.Option(
+        DEFAULT_HOST,
+        "--host",
+        help="Address to listen on. Defaults to local requests only.",
+    ),
+    port: int = typer.Option(
+        DEFAULT_PORT,
+        "--port",
+        help="Port to listen on.",
+    ),
+    max_cached_classifiers: int = typer.Option(
+        DEFAULT_MAX_CACHED_CLASSIFIERS,
+        "--max-cached-classifiers",
+        help="Number of recently used classifiers to keep in memory.",
+    ),
+    checkpoint_dir: Optional[str] = typer.Option(
+        None,
+        "--checkpoint-dir",
+        help="Local directory for checkpoints. Defaults to a temporary directory.",
+    ),
+) -> None:
+    """
+    Run a warm worker which serves concept inference requests over HTTP.
+
+    The dataset, embeddings, embedding model and recently used classifiers stay
+    loaded between requests.
+
+    Examples:
+        vibe-checker serve
+        curl -X POST localhost:8765/infer -d '{"concept_id": "Q69"}'
+    """
+    try:
+        serve_inference(
+            host=host,
+            port=port,
+            max_cached_classifiers=max_cached_classifiers,
+            checkpoint_dir=checkpoint_dir,
+        )
+    except ValueError as e:
+        typer.echo(f"✗ Error: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+    except Exception as e:
+        typer.echo(f"✗ Unexpected error: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+
+
+@app.command("build-embeddings")
+def build_embeddings_command(
+    model: Optional[str] = typer.Option(
+        None,
+        "--model",
+        "-m",
+        help=(
+            "Sentence-transformers model to encode passages with. Defaults to the "
+            "model used for the existing embeddings."
+        ),
+    ),
+    chunk_size: int = typer.Option(
+        DEFAULT_ENCODE_CHUNK_SIZE,
+        "--chunk-size",
+        help="Number of new passages to encode at a time.",
+    ),
+) -> None:
+    """
+    Build the passages embeddings, encoding only passages which are new.
+
+    Examples:
+        vibe-checker build-embeddings       # Embed new passages with the existing model
+        vibe-checker build-embeddings --model BAAI/bge-small-en-v1.5
+                                            # Re-embed every passage with a new model
+    """
+    try:
+        result = build_passages_embeddings(
+            embedding_model_name=model, chunk_size=chunk_size
+        )
+        typer.echo(
+            f"✓ Embedded {result['n_encoded']} new passages "
+            f"({result['n_passages']} in total)",
+            err=False,
+        )
+    except ValueError as e:
+        typer.echo(f"✗ Error: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+    except Exception as e:
+        typer.echo(f"✗ Unexpected error: {str(e)}", err=True)
+        raise typer.Exit(code=1)
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,242 @@
+import io
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from mypy_boto3_s3 import S3Client
+from prefect.logging import get_logger
+
+logger = get_logger(__name__)
+
+KEYWORD_INDEX_PREFIX = "keyword_index"
+# Bump this whenever the way the index is built changes, so that stale indexes in
+# S3 aren't reused
+KEYWORD_INDEX_VERSION = 1
+
+# Classifiers which only match their concept's labels in the passage text, so
+# passages which don't contain any of the labels can't have any spans
+PREFILTER_CLASSIFIERS = {"KeywordClassifier"}
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# The number of passages to tokenise at a time when building the index
+DEFAULT_BUILD_CHUNK_SIZE = 10_000
+
+
+def normalise(text: str) -> str:
+    """
+    Normalise text for the index.
+
+    Case folding makes the index case-insensitive, and matches the case-insensitive
+    matching of the regex engine more closely than lowercasing does.
+    """
+    return text.casefold()
+
+
+def keyword_labels(classifier: object) -> list[str] | None:
+    """
+    Get the labels which a classifier matches in passage text.
+
+    Returns None for classifiers whose predictions can't be narrowed down using the
+    keyword index.
+    """
+    if type(classifier).__name__ not in PREFILTER_CLASSIFIERS:
+        return None
+    concept = getattr(classifier, "concept", None)
+    if concept is None:
+        return None
+    return list(concept.all_labels)
+
+
+class KeywordIndex:
+    """
+    An inverted index from normalised tokens to the passages which contain them.
+
+    The vocabulary is held as a single newline-separated string, so that it can be
+    searched for tokens which contain a substring without a Python loop over every
+    token. A label can only match a passage if the label's longest token is part of
+    one of the passage's tokens, whatever the classifier's rules about word
+    boundaries, so the index gives a superset of the passages which can match.
+    """
+
+    def __init__(
+        self,
+        vocabulary: str,
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        n_passages: int,
+    ):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.rows = rows
+        self.n_passages = n_passages
+        # The position in the vocabulary string at which each token starts
+        token_lengths = np.fromiter(
+            (len(token) + 1 for token in vocabulary.split("\n")),
+            dtype=np.int64,
+            count=len(offsets) - 1,
+        )
+        self._token_starts = np.concatenate([[0], np.cumsum(token_lengths)[:-1]])
+
+    @classmethod
+    def build(
+        cls, texts: pd.Series, chunk_size: int = DEFAULT_BUILD_CHUNK_SIZE
+    ) -> "KeywordIndex":
+        """
+        Build the index for the passages' texts, in the order they're given.
+
+        The texts are tokenised a chunk at a time, and each chunk's tokens are
+        turned into integer codes straight away, so only one chunk's worth of token
+        strings is held at once. The rest of the build works on arrays of token codes
+        and row numbers.
+        """
+        # The code of each token, in the order the tokens were first seen
+        vocabulary: dict[str, int] = {}
+        chunk_codes, chunk_rows = [], []
+        for start in range(0, len(texts), chunk_size):
+            chunk_tokens, n_tokens = [], []
+            for text in texts.iloc[start : start + chunk_size]:
+                # Texts are converted to strings in the same way as they are for
+                # inference
+                passage_tokens = set(TOKEN_PATTERN.findall(normalise(str(text))))
+                chunk_tokens.extend(passage_tokens)
+                n_tokens.append(len(passage_tokens))
+            codes, chunk_vocabulary = pd.factorize(np.array(chunk_tokens, dtype=object))
+            vocabulary_codes = np.fromiter(
+                (
+                    vocabulary.setdefault(token, len(vocabulary))
+                    for token in chunk_vocabulary
+                ),
+                dtype=np.int32,
+                count=len(chunk_vocabulary),
+            )
+            chunk_codes.append(vocabulary_codes[codes])
+            chunk_rows.append(
+                np.repeat(
+                    np.arange(start, start + len(n_tokens), dtype=np.int32), n_tokens
+                )
+            )
+
+        codes = np.concatenate(chunk_codes or [np.empty(0, dtype=np.int32)])
+        rows = np.concatenate(chunk_rows or [np.empty(0, dtype=np.int32)])
+        del chunk_codes, chunk_rows
+        # Group the rows by token, keeping each token's rows in order
+        order = np.argsort(codes, kind="stable")
+        rows = rows[order]
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(vocabulary)), out=offsets[1:])
+        return cls(
+            vocabulary="\n".join(vocabulary),
+            offsets=offsets,
+            rows=rows,
+            n_passages=len(texts),
+        )
+
+    def to_bytes(self) -> bytes:
+        """Serialise the index."""
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            vocabulary=np.frombuffer(self.vocabulary.encode("utf-8"), dtype=np.uint8),
+            offsets=self.offsets,
+            rows=self.rows,
+            n_passages=np.array(self.n_passages),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KeywordIndex":
+        """Load a serialised index."""
+        with np.load(io.BytesIO(data)) as index:
+            return cls(
+                vocabulary=index["vocabulary"].tobytes().decode("utf-8"),
+                offsets=index["offsets"],
+                rows=index["rows"],
+                n_passages=int(index["n_passages"]),
+            )
+
+    def candidates(self, labels: list[str]) -> np.ndarray | None:
+        """
+        Find the passages which could contain any of the labels.
+
+        Returns a boolean mask over the passages, or None if one of the labels
+        can't be looked up in the index (eg because it has no word characters).
+        """
+        mask = np.zeros(self.n_passages, dtype=bool)
+        for label in labels:
+            label_tokens = TOKEN_PATTERN.findall(normalise(label))
+            if not label_tokens:
+                return None
+            for token in self._tokens_containing(max(label_tokens, key=len)):
+                mask[self.rows[self.offsets[token] : self.offsets[token + 1]]] = True
+        return mask
+
+    def _tokens_containing(self, substring: str) -> np.ndarray:
+        positions = [
+            match.start()
+            for match in re.finditer(re.escape(substring), self.vocabulary)
+        ]
+        return np.unique(
+            np.searchsorted(self._token_starts, positions, side="right") - 1
+        )
+
+
+class SharedKeywordIndex:
+    """
+    The keyword index for a version of the passages dataset, shared by every task.
+
+    The index is loaded or built the first time it's needed, and stored in S3
+    under `keyword_index/`, keyed on the dataset's version, so that it's only built
+    once for each version of the dataset.
+    """
+
+    def __init__(
+        self,
+        texts: pd.Series,
+        dataset_version: str,
+        s3_client: S3Client,
+        bucket_name: str,
+    ):
+        self.texts = texts
+        self.dataset_version = dataset_version
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self._index: KeywordIndex | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def key(self) -> str:
+        """The S3 key of the index for this version of the dataset."""
+        return (
+            f"{KEYWORD_INDEX_PREFIX}/v{KEYWORD_INDEX_VERSION}-"
+            f"{self.dataset_version}.npz"
+        )
+
+    def get(self) -> KeywordIndex:
+        """Get the index, loading or building it if we haven't already."""
+        with self._lock:
+            if self._index is None:
+                self._index = self._load() or self._build()
+            return self._index
+
+    def _load(self) -> KeywordIndex | None:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return None
+            raise
+        index = KeywordIndex.from_bytes(response["Body"].read())
+        logger.info(f"Loaded the keyword index from {self.key}")
+        return index
+
+    def _build(self) -> KeywordIndex:
+        logger.info(f"Building the keyword index for {len(self.texts)} passages...")
+        index = KeywordIndex.build(self.texts)
+        self.s3_client.put_object(
+            Bucket=self.bucket_name, Key=self.key, Body=index.to_bytes()
+        )
+        logger.info(f"Stored the keyword index in {self.key}")
+        return index
@@ -0,0 +1,154 @@
+from typing import Annotated, Literal, Union
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field, TypeAdapter
+
+
+class ThresholdSelection(BaseModel):
+    """
+    Select every passage above a similarity threshold, within a min/max range.
+
+    If there are at least `min_passages` passages above the threshold, we take all
+    of them (up to `max_passages`). Otherwise, we take everything above the
+    threshold, and then supplement the list with the passages which are closest to
+    the threshold until we reach `min_passages`.
+    """
+
+    strategy: Literal["threshold"] = "threshold"
+    similarity_threshold: float = 0.65
+    min_passages: int = Field(default=10_000, ge=0)
+    max_passages: int = Field(default=100_000, ge=1)
+
+    def select(self, passages: pd.DataFrame) -> pd.DataFrame:
+        """Select passages from a dataset sorted by descending similarity."""
+        above_threshold = passages[passages["similarity"] > self.similarity_threshold]
+        below_threshold = passages[passages["similarity"] <= self.similarity_threshold]
+
+        if len(above_threshold) >= self.min_passages:
+            selected_passages = above_threshold
+        else:
+            # Below the threshold, the passages are already sorted by descending
+            # similarity, ie with the passages closest to the threshold first
+            remaining_needed = self.min_passages - len(above_threshold)
+            selected_passages = pd.concat(
+                [above_threshold, below_threshold.head(remaining_needed)]
+            )
+
+        # Ensure we don't exceed max_passages in either scenario
+        selected_passages = selected_passages.head(self.max_passages)
+        assert isinstance(selected_passages, pd.DataFrame)
+        return selected_passages
+
+
+class StratifiedSelection(BaseModel):
+    """
+    Select a fixed number of passages, spread across similarity bands and metadata.
+
+    The budget of `max_passages` is split evenly between the similarity bands
+    defined by `similarity_bands` (with any budget which a band can't use passed on
+    to the others), so that less similar passages are represented alongside the
+    most similar ones. Within each band, passages are sampled at random, but evenly
+    across the combinations of values in the `stratify_by` columns, eg so that every
+    region and corpus type is represented.
+    """
+
+    strategy: Literal["stratified"] = "stratified"
+    max_passages: int = Field(default=5_000, ge=1)
+    similarity_bands: list[float] = [0.5, 0.6, 0.7, 0.8]
+    stratify_by: list[str] = [
+        "world_bank_region",
+        "document_metadata.corpus_type_name",
+    ]
+    seed: int = 42
+
+    def select(self, passages: pd.DataFrame) -> pd.DataFrame:
+        """Select passages from a dataset sorted by descending similarity."""
+        missing_columns = set(self.stratify_by) - set(passages.columns)
+        if missing_columns:
+            raise ValueError(
+                f"Can't stratify by columns missing from the dataset: {missing_columns}"
+            )
+
+        bands = pd.cut(
+            passages["similarity"],
+            bins=[-np.inf, *sorted(self.similarity_bands), np.inf],
+        )
+        band_groups = [
+            group for _, group in passages.groupby(bands, observed=True, sort=False)
+        ]
+        allocations = _allocate_budget(
+            self.max_passages, [len(group) for group in band_groups]
+        )
+
+        selected_bands = []
+        for group, allocation in zip(band_groups, allocations):
+            if allocation == 0:
+                continue
+            shuffled = group.sample(frac=1, random_state=self.seed)
+            if self.stratify_by:
+                # Interleave the strata by taking the first passage from every
+                # stratum, then the second from every stratum, etc.
+                rank_in_stratum = shuffled.groupby(
+                    self.stratify_by, dropna=False, sort=False
+                ).cumcount()
+                shuffled = shuffled.iloc[
+                    np.argsort(rank_in_stratum.to_numpy(), kind="stable")
+                ]
+            selected_bands.append(shuffled.head(allocation))
+
+        if not selected_bands:
+            return passages.head(0)
+        return pd.concat(selected_bands).sort_values("similarity", ascending=False)
+
+
+class BudgetSelection(BaseModel):
+    """
+    Spend a fixed compute budget on the passages most similar to the concept.
+
+    Exactly `max_passages` passages (or the whole dataset, if it's smaller) are
+    passed to the classifier, regardless of their similarity to the concept.
+    """
+
+    strategy: Literal["budget"] = "budget"
+    max_passages: int = Field(default=2_000, ge=1)
+
+    def select(self, passages: pd.DataFrame) -> pd.DataFrame:
+        """Select passages from a dataset sorted by descending similarity."""
+        return passages.head(self.max_passages)
+
+
+SelectionStrategy = Annotated[
+    Union[ThresholdSelection, StratifiedSelection, BudgetSelection],
+    Field(discriminator="strategy"),
+]
+
+_selection_strategy_adapter = TypeAdapter(SelectionStrategy)
+
+
+def parse_selection_strategy(config: dict | None = None) -> SelectionStrategy:
+    """
+    Parse a selection strategy from its config, eg from concepts.yml.
+
+    If no strategy is named in the config, the threshold strategy is used.
+    """
+    config = {"strategy": "threshold", **(config or {})}
+    return _selection_strategy_adapter.validate_python(config)
+
+
+def _allocate_budget(budget: int, capacities: list[int]) -> list[int]:
+    """Split a budget as evenly as possible between groups with limited capacity."""
+    allocations = [0] * len(capacities)
+    remaining = budget
+    open_groups = [i for i, capacity in enumerate(capacities) if capacity > 0]
+    while remaining > 0 and open_groups:
+        share = max(remaining // len(open_groups), 1)
+        for i in list(open_groups):
+            extra = min(share, capacities[i] - allocations[i], remaining)
+            allocations[i] += extra
+            remaining -= extra
+            if allocations[i] == capacities[i]:
+                open_groups.remove(i)
+            if remaining == 0:
+                break
+    return allocations
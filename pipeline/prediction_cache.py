@@ -0,0 +1,184 @@
+import gzip
+import hashlib
+import importlib.metadata
+import json
+import sys
+import time
+
+from botocore.exceptions import ClientError
+from knowledge_graph.span import Span
+from mypy_boto3_s3 import S3Client
+
+PREDICTION_CACHE_PREFIX = "prediction_cache"
+# Bump this whenever the format of the cached spans changes, so that stale caches
+# aren't reused
+PREDICTION_CACHE_VERSION = 2
+DEFAULT_MAX_ENTRIES = 250_000
+DEFAULT_MAX_AGE_DAYS = 90
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def classifier_library_version() -> str:
+    """
+    Get the version of the knowledge-graph library which the classifiers come from.
+
+    The library is installed from git, so its package version doesn't necessarily
+    change along with its code. Where it's available, the commit it was installed
+    from is included as well.
+    """
+    try:
+        distribution = importlib.metadata.distribution("knowledge-graph")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+    direct_url = json.loads(distribution.read_text("direct_url.json") or "{}")
+    commit_id = direct_url.get("vcs_info", {}).get("commit_id")
+    if commit_id:
+        return f"{distribution.version}+{commit_id[:12]}"
+    return distribution.version
+
+
+# Predictions from a different version of the classifiers' code shouldn't be served
+# from the cache, even if the classifier's id is the same
+CLASSIFIER_LIBRARY_VERSION = classifier_library_version()
+
+
+def hash_text(text: str) -> str:
+    """Get a short, stable hash of a passage's text for use as a cache key."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Most passages have no spans, so they all share the same compact form
+NO_SPANS = "[]"
+
+
+def compact_spans(spans: list[Span]) -> str:
+    """
+    Convert spans to a compact JSON string, without their text.
+
+    A single string takes a fraction of the memory of the equivalent lists and
+    dicts, which matters when holding the spans for many passages.
+    """
+    if not spans:
+        return NO_SPANS
+    return json.dumps(
+        [span.model_dump(mode="json", exclude={"text"}) for span in spans],
+        separators=(",", ":"),
+    )
+
+
+def expand_spans(text: str, compact: str) -> list[Span]:
+    """Rebuild the spans for a passage from their compact form."""
+    return [Span.model_validate({**span, "text": text}) for span in json.loads(compact)]
+
+
+class PredictionCache:
+    """
+    Cache of the spans predicted by a single classifier, keyed on passage text hash.
+
+    Each classifier's cache is stored as a single gzipped JSON object in S3, under
+    `prediction_cache/v{n}/{library_version}/{classifier_id}.json.gz`, so a new
+    version of the cache format or of the classifiers' library starts a new cache.
+    Spans are stored without their text (which is the passage text, and therefore
+    redundant), alongside the day on which the entry was last used. When the cache is
+    saved, entries which haven't been used in the last `max_age_days` are evicted,
+    followed by the least recently used entries until the cache holds at most
+    `max_entries`.
+    """
+
+    def __init__(
+        self,
+        classifier_id: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_age_days: int = DEFAULT_MAX_AGE_DAYS,
+    ):
+        self.classifier_id = classifier_id
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._today = int(time.time() // SECONDS_PER_DAY)
+        # text hash -> (day last used, compact spans without their text)
+        self._entries: dict[str, tuple[int, str]] = {}
+
+    @property
+    def key(self) -> str:
+        """The S3 key where this classifier's cache is stored."""
+        return (
+            f"{PREDICTION_CACHE_PREFIX}/v{PREDICTION_CACHE_VERSION}/"
+            f"{CLASSIFIER_LIBRARY_VERSION}/{self.classifier_id}.json.gz"
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups which were served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        """The number of passages with cached predictions."""
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory used by the cached entries, in bytes."""
+        return sys.getsizeof(self._entries) + sum(
+            sys.getsizeof(text_hash) + sys.getsizeof(entry) + sys.getsizeof(entry[1])
+            for text_hash, entry in self._entries.items()
+        )
+
+    @classmethod
+    def load(
+        cls, s3_client: S3Client, bucket_name: str, classifier_id: str, **kwargs
+    ) -> "PredictionCache":
+        """Load a classifier's cache from S3, or start an empty one if none exists."""
+        cache = cls(classifier_id, **kwargs)
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=cache.key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return cache
+            raise
+        entries = json.loads(gzip.decompress(response["Body"].read()))
+        cache._entries = {
+            # Share a single copy of the (very common) empty predictions
+            text_hash: (last_used, NO_SPANS if spans == NO_SPANS else spans)
+            for text_hash, (last_used, spans) in entries.items()
+        }
+        return cache
+
+    def get(self, text: str) -> list[Span] | None:
+        """Get the cached spans for a passage, or None if it hasn't been predicted."""
+        text_hash = hash_text(text)
+        entry = self._entries.get(text_hash)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        _, spans = entry
+        self._entries[text_hash] = (self._today, spans)
+        return expand_spans(text, spans)
+
+    def put(self, text: str, spans: list[Span]) -> None:
+        """Store the spans predicted for a passage."""
+        self._entries[hash_text(text)] = (self._today, compact_spans(spans))
+
+    def evict(self) -> int:
+        """Evict stale and least recently used entries, returning the number evicted."""
+        n_entries = len(self._entries)
+        oldest_allowed = self._today - self.max_age_days
+        entries = sorted(
+            (item for item in self._entries.items() if item[1][0] >= oldest_allowed),
+            key=lambda item: item[1][0],
+            reverse=True,
+        )
+        self._entries = dict(entries[: self.max_entries])
+        return n_entries - len(self._entries)
+
+    def save(self, s3_client: S3Client, bucket_name: str) -> None:
+        """Evict old entries and write the cache back to S3."""
+        self.evict()
+        data = gzip.compress(
+            json.dumps(self._entries, separators=(",", ":")).encode("utf-8")
+        )
+        s3_client.put_object(Bucket=bucket_name, Key=self.key, Body=data)
@@ -0,0 +1,101 @@
+import json
+from array import array
+from typing import Callable
+
+import numpy as np
+from knowledge_graph.span import Span
+
+
+class ConceptPredictions:
+    """
+    A compact, array-backed store of a classifier's predictions for a concept.
+
+    Rather than holding a list of Span objects for every passage, the spans are
+    stored in flat arrays of start and end indices, with an index into a table of
+    the spans' other fields (eg their concept and labellers), which are usually
+    shared by many spans. Passages with the same text share a single prediction, and
+    each passage's position in the selection is mapped to its prediction.
+
+    Spans are only turned back into Span objects one passage at a time, as the
+    outputs are written.
+    """
+
+    def __init__(self, n_passages: int):
+        # passage position -> prediction number
+        self.prediction_of_passage = np.full(n_passages, -1, dtype=np.int32)
+        # prediction number -> first span (with a final entry for the end)
+        self._span_offsets = array("q", [0])
+        self._starts = array("q")
+        self._ends = array("q")
+        self._fields = array("l")
+        self._field_table: list[dict] = []
+        self._field_numbers: dict[str, int] = {}
+        self._prediction_of_text: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        """The number of unique passage texts with predictions."""
+        return len(self._span_offsets) - 1
+
+    @property
+    def n_spans(self) -> int:
+        """The total number of spans stored, across every unique passage text."""
+        return len(self._starts)
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory used by the spans' arrays, in bytes."""
+        return self.prediction_of_passage.nbytes + sum(
+            len(a) * a.itemsize
+            for a in (self._span_offsets, self._starts, self._ends, self._fields)
+        )
+
+    def record(
+        self, position: int, text: str, predict: Callable[[str], list[Span]]
+    ) -> int:
+        """
+        Record the spans for a passage, predicting them if its text is new.
+
+        Returns the number of spans in the passage.
+        """
+        prediction = self._prediction_of_text.get(text)
+        if prediction is None:
+            prediction = self._add(predict(text))
+            self._prediction_of_text[text] = prediction
+        self.prediction_of_passage[position] = prediction
+        return self._span_offsets[prediction + 1] - self._span_offsets[prediction]
+
+    def spans(self, position: int, text: str) -> list[Span]:
+        """Rebuild the spans for a passage."""
+        prediction = int(self.prediction_of_passage[position])
+        if prediction < 0:
+            raise KeyError(f"No prediction has been recorded for passage {position}")
+        return [
+            Span.model_validate(
+                {
+                    **self._field_table[self._fields[i]],
+                    "text": text,
+                    "start_index": self._starts[i],
+                    "end_index": self._ends[i],
+                }
+            )
+            for i in range(
+                self._span_offsets[prediction], self._span_offsets[prediction + 1]
+            )
+        ]
+
+    def _add(self, spans: list[Span]) -> int:
+        for span in spans:
+            fields = span.model_dump(
+                mode="json", exclude={"text", "start_index", "end_index"}
+            )
+            key = json.dumps(fields, sort_keys=True)
+            field_number = self._field_numbers.get(key)
+            if field_number is None:
+                field_number = len(self._field_table)
+                self._field_table.append(fields)
+                self._field_numbers[key] = field_number
+            self._starts.append(span.start_index)
+            self._ends.append(span.end_index)
+            self._fields.append(field_number)
+        self._span_offsets.append(len(self._starts))
+        return len(self._span_offsets) - 2
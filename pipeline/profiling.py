@@ -0,0 +1,230 @@
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Literal
+
+ProfilerType = Literal["sampling", "deterministic"]
+
+DEFAULT_SAMPLING_INTERVAL = 0.005
+DEFAULT_N_HOTSPOTS = 25
+# The number of frames to keep for each traced memory allocation
+TRACEMALLOC_FRAMES = 25
+
+
+def _line_name(filename: str, line: int) -> str:
+    return f"{Path(filename).name}:{line}"
+
+
+def _frame_name(filename: str, name: str, line: int) -> str:
+    return f"{name} ({_line_name(filename, line)})"
+
+
+class SamplingProfiler:
+    """
+    Samples the call stacks of running threads at a regular interval.
+
+    Unlike cProfile, this sees every thread (eg the stages of the streaming
+    pipeline), and adds very little overhead. Stacks are recorded in the folded
+    format used by flamegraph.pl and speedscope, with the thread's name as the root
+    frame.
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_SAMPLING_INTERVAL,
+        thread_filter: Callable[[threading.Thread], bool] | None = None,
+    ):
+        self.interval = interval
+        self.thread_filter = thread_filter
+        self.stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, name="sampling-profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        """Start sampling."""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling."""
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            threads = {
+                thread.ident: thread
+                for thread in threading.enumerate()
+                if thread is not self._thread
+                and (self.thread_filter is None or self.thread_filter(thread))
+            }
+            for thread_id, frame in sys._current_frames().items():
+                thread = threads.get(thread_id)
+                if thread is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        _frame_name(code.co_filename, code.co_name, code.co_firstlineno)
+                    )
+                    frame = frame.f_back
+                stack.append(thread.name)
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        """The sampled stacks, in the folded format, with one stack per line."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.items())
+
+    def hotspots(self, n: int = DEFAULT_N_HOTSPOTS) -> str:
+        """A markdown table of the functions with the most samples."""
+        total = sum(self.stacks.values()) or 1
+        own_samples: Counter[str] = Counter()
+        total_samples: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own_samples[frames[-1]] += count
+            for frame in set(frames):
+                total_samples[frame] += count
+        rows = [
+            f"| `{frame}` | {count / total:.1%} | {total_samples[frame] / total:.1%} |"
+            for frame, count in own_samples.most_common(n)
+        ]
+        return "\n".join(
+            [
+                f"{total} samples, every {self.interval * 1000:.0f}ms",
+                "",
+                "| Function | Own | Total |",
+                "| --- | --- | --- |",
+                *rows,
+            ]
+        )
+
+
+class Profiler:
+    """
+    Profiles the code run inside it, optionally tracing memory allocations.
+
+    The `sampling` profiler samples the stacks of every thread, while the
+    `deterministic` profiler uses cProfile to trace every call in the thread which
+    enters the profiler (but not in any other threads).
+
+    Use the profiler as a context manager, and then get its output files and a
+    markdown summary of the hotspots.
+    """
+
+    def __init__(
+        self,
+        profiler: ProfilerType = "sampling",
+        trace_memory: bool = False,
+        interval: float = DEFAULT_SAMPLING_INTERVAL,
+        thread_filter: Callable[[threading.Thread], bool] | None = None,
+    ):
+        if profiler not in ("sampling", "deterministic"):
+            raise ValueError(f"Unknown profiler: {profiler}")
+        self.profiler = profiler
+        self.trace_memory = trace_memory
+        self._sampling_profiler = (
+            SamplingProfiler(interval=interval, thread_filter=thread_filter)
+            if profiler == "sampling"
+            else None
+        )
+        self._cprofile = cProfile.Profile() if profiler == "deterministic" else None
+        self._memory_snapshot: tracemalloc.Snapshot | None = None
+        self._memory_peak = 0
+
+    def __enter__(self) -> "Profiler":
+        """Start profiling."""
+        if self.trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if self._sampling_profiler is not None:
+            self._sampling_profiler.start()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Stop profiling."""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._sampling_profiler is not None:
+            self._sampling_profiler.stop()
+        if self.trace_memory:
+            self._memory_snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            self._memory_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def files(self) -> dict[str, bytes]:
+        """
+        The profiler's output files, keyed on file name.
+
+        - `profile.folded`: sampled stacks, for flamegraph.pl or speedscope
+        - `profile.prof`: cProfile stats, for snakeviz or flameprof
+        - `memory.folded`: the stacks of the memory which was still allocated at
+          the end, weighted by size in bytes, for a memory flamegraph
+        """
+        files = {}
+        if self._sampling_profiler is not None:
+            files["profile.folded"] = self._sampling_profiler.folded().encode("utf-8")
+        if self._cprofile is not None:
+            self._cprofile.create_stats()
+            files["profile.prof"] = _marshal_stats(self._cprofile)
+        if self._memory_snapshot is not None:
+            lines = []
+            for statistic in self._memory_snapshot.statistics("traceback"):
+                frames = [
+                    _line_name(frame.filename, frame.lineno)
+                    for frame in reversed(statistic.traceback)
+                ]
+                lines.append(f"{';'.join(frames)} {statistic.size}")
+            files["memory.folded"] = "\n".join(lines).encode("utf-8")
+        return files
+
+    def hotspots(self, n: int = DEFAULT_N_HOTSPOTS) -> str:
+        """A markdown summary of where the time (and memory) went."""
+        sections = []
+        if self._sampling_profiler is not None:
+            sections.append(f"## CPU hotspots\n\n{self._sampling_profiler.hotspots(n)}")
+        if self._cprofile is not None:
+            output = io.StringIO()
+            pstats.Stats(self._cprofile, stream=output).sort_stats(
+                "tottime"
+            ).print_stats(n)
+            sections.append(f"## CPU hotspots\n\n```\n{output.getvalue()}\n```")
+        if self._memory_snapshot is not None:
+            statistics = self._memory_snapshot.statistics("lineno")
+            rows = [
+                f"| `{_line_name(s.traceback[0].filename, s.traceback[0].lineno)}` "
+                f"| {s.size / 1024 / 1024:.1f}MB | {s.count} |"
+                for s in statistics[:n]
+            ]
+            sections.append(
+                "\n".join(
+                    [
+                        "## Memory still allocated at the end",
+                        "",
+                        f"Peak traced memory: {self._memory_peak / 1024 / 1024:.1f}MB",
+                        "",
+                        "| Line | Size | Allocations |",
+                        "| --- | --- | --- |",
+                        *rows,
+                    ]
+                )
+            )
+        return "\n\n".join(sections)
+
+
+def _marshal_stats(profile: cProfile.Profile) -> bytes:
+    """Serialise cProfile stats in the format written by `dump_stats`."""
+    return marshal.dumps(profile.stats)  # type: ignore[attr-defined]
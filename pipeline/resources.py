@@ -0,0 +1,303 @@
+import os
+import resource
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, TypeVar
+
+from prefect.futures import PrefectFuture, wait
+from prefect.logging import get_logger
+
+logger = get_logger(__name__)
+
+MB = 1024 * 1024
+
+# Rough peak memory of each type of classifier while it's loaded and predicting, on
+# top of the memory needed for the concept's copy of the dataset. Unknown types of
+# classifier are assumed to need DEFAULT_CLASSIFIER_MEMORY.
+CLASSIFIER_MEMORY_ESTIMATES = {
+    "KeywordClassifier": 64 * MB,
+    "StemmedKeywordClassifier": 128 * MB,
+    "RulesBasedClassifier": 64 * MB,
+    "EmbeddingClassifier": 1024 * MB,
+    "BertBasedClassifier": 2048 * MB,
+}
+DEFAULT_CLASSIFIER_MEMORY = 1024 * MB
+# We don't know which classifier the ClassifierFactory will pick for a concept
+# until it's been created, so for concepts we haven't seen before, we assume it
+# could be the biggest
+FACTORY_CLASSIFIER_MEMORY = max(CLASSIFIER_MEMORY_ESTIMATES.values())
+
+# The fraction of the container's memory which concept tasks are allowed to use,
+# leaving some headroom for everything else
+MEMORY_HEADROOM = 0.8
+
+# New concept tasks aren't submitted while the process's RSS is above the high
+# water mark (as a fraction of the memory limit), until it falls back below the low
+# water mark
+MEMORY_HIGH_WATER = 0.9
+MEMORY_LOW_WATER = 0.75
+
+
+def available_cpus() -> int:
+    """
+    Get the number of CPUs available to this process.
+
+    Respects cgroup CPU quotas (eg the CPU limit of an ECS task), which os.cpu_count
+    doesn't know about.
+    """
+    try:
+        n_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_cpus = os.cpu_count() or 1
+
+    quota = None
+    cgroup_v2_cpu_max = Path("/sys/fs/cgroup/cpu.max")
+    cgroup_v1_quota = Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    cgroup_v1_period = Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    try:
+        if cgroup_v2_cpu_max.exists():
+            max_value, period = cgroup_v2_cpu_max.read_text().split()
+            if max_value != "max":
+                quota = int(max_value) / int(period)
+        elif cgroup_v1_quota.exists() and cgroup_v1_period.exists():
+            max_value = int(cgroup_v1_quota.read_text())
+            if max_value > 0:
+                quota = max_value / int(cgroup_v1_period.read_text())
+    except (OSError, ValueError):
+        pass
+
+    if quota is not None:
+        n_cpus = min(n_cpus, max(int(quota), 1))
+    return n_cpus
+
+
+def available_memory() -> int:
+    """
+    Get the memory available to this process, in bytes.
+
+    Respects cgroup memory limits (eg the memory limit of an ECS task), falling
+    back to the machine's physical memory.
+    """
+    physical_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for limit_path in [
+        Path("/sys/fs/cgroup/memory.max"),
+        Path("/sys/fs/cgroup/memory/memory.limit_in_bytes"),
+    ]:
+        try:
+            limit = limit_path.read_text().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            return min(int(limit), physical_memory)
+    return physical_memory
+
+
+def current_rss() -> int:
+    """Get the resident set size of this process, in bytes."""
+    try:
+        resident_pages = int(Path("/proc/self/statm").read_text().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak rather than the current RSS, in KB on linux and
+        # bytes on macOS, but it's the best we can do
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == "Darwin" else max_rss * 1024
+
+
+def estimate_classifier_memory(
+    classifier_type: str, previous_types: list[str] | None = None
+) -> int:
+    """
+    Estimate the peak memory needed by a type of classifier, in bytes.
+
+    The estimate is made from the name of the classifier's type, so that memory
+    can be reserved before the classifier (and any model weights) are loaded. The
+    `default` type is whichever classifier the ClassifierFactory picks, so it's
+    estimated from the `previous_types` of classifier which the concept produced
+    in its last run, or as the biggest classifier if it hasn't been run before.
+    """
+    if classifier_type == "default":
+        if previous_types:
+            return max(estimate_classifier_memory(t) for t in previous_types)
+        return FACTORY_CLASSIFIER_MEMORY
+    return CLASSIFIER_MEMORY_ESTIMATES.get(classifier_type, DEFAULT_CLASSIFIER_MEMORY)
+
+
+class MemoryBudget:
+    """
+    Admits concept tasks only while their estimated memory fits within a budget.
+
+    Tasks reserve their estimated memory before doing any memory-heavy work, and
+    wait until enough of the budget has been released by other tasks. A task whose
+    estimate is bigger than the whole budget is admitted once it has the budget to
+    itself. The budget is unlimited until it's configured.
+    """
+
+    def __init__(self, total: int | None = None):
+        self.total = total
+        self._used = 0
+        self._condition = threading.Condition()
+
+    def configure(self, total: int | None) -> None:
+        """Set the total memory available to tasks, in bytes."""
+        with self._condition:
+            self.total = total
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, n_bytes: int) -> Iterator[None]:
+        """Wait until the memory is available, and hold on to it until exiting."""
+        with self._condition:
+            if self.total is not None:
+                n_bytes = min(n_bytes, self.total)
+            self._condition.wait_for(
+                lambda: self.total is None or self._used + n_bytes <= self.total
+            )
+            self._used += n_bytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._used -= n_bytes
+                self._condition.notify_all()
+
+
+class PeakMemoryTracker:
+    """
+    Tracks the peak RSS of the process while some work is running.
+
+    The RSS is sampled in a background thread. Concept tasks run as threads in the
+    same process, so `peak` is the peak of the whole process while the task was
+    running, including any other tasks running alongside it. `peak_increase` is how
+    far that peak rose above the RSS when tracking started, which is closer to the
+    memory used by the task itself.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.start_rss = current_rss()
+        self.peak = self.start_rss
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, name="peak-memory-tracker", daemon=True
+        )
+
+    def __enter__(self) -> "PeakMemoryTracker":
+        """Start tracking the peak memory."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Stop tracking the peak memory."""
+        self.stop()
+
+    @property
+    def peak_increase(self) -> int:
+        """How far the peak RSS rose above the RSS when tracking started, in bytes."""
+        return max(self.peak - self.start_rss, 0)
+
+    def start(self) -> None:
+        """Start sampling the RSS."""
+        self.start_rss = current_rss()
+        self.peak = self.start_rss
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling the RSS, taking one last sample."""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+class MemoryGuard:
+    """
+    Decides when to hold back new concept tasks because memory is running low.
+
+    Once the process's RSS reaches the high water mark of the limit, new tasks are
+    held back until it has fallen below the low water mark, so that we don't keep
+    bouncing off the limit.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        high_water: float = MEMORY_HIGH_WATER,
+        low_water: float = MEMORY_LOW_WATER,
+    ):
+        self.limit = limit
+        self.high_water = high_water
+        self.low_water = low_water
+        self.peak = current_rss()
+        self.n_pauses = 0
+        self._paused = False
+
+    def should_pause(self) -> bool:
+        """Check whether new tasks should be held back for now."""
+        rss = current_rss()
+        self.peak = max(self.peak, rss)
+        if self._paused:
+            self._paused = rss > self.limit * self.low_water
+        elif rss >= self.limit * self.high_water:
+            self._paused = True
+            self.n_pauses += 1
+        return self._paused
+
+
+def plan_concurrency(
+    max_concurrency: int, n_cpus: int, memory_budget: int, task_memory: int
+) -> int:
+    """Work out how many concept tasks can run at once on the available resources."""
+    by_memory = memory_budget // max(task_memory, 1)
+    return max(1, min(max_concurrency, n_cpus, by_memory))
+
+
+T = TypeVar("T")
+
+
+def submit_with_concurrency_limit(
+    items: list[T],
+    submit: Callable[[T], PrefectFuture],
+    concurrency: int,
+    poll_interval: float = 1.0,
+    memory_guard: MemoryGuard | None = None,
+) -> list[PrefectFuture]:
+    """
+    Submit a task for each item, keeping at most `concurrency` tasks running at once.
+
+    If there's a `memory_guard`, new tasks are held back while memory is close to
+    the limit. Since that many tasks at once came close to the limit, the
+    concurrency is also lowered to one fewer than the number of tasks which were
+    running at the time, so that the process isn't OOM-killed. At least one task is
+    always allowed to run.
+
+    Returns the futures for every task, in the same order as the items, once all of
+    them have been submitted.
+    """
+    futures: list[PrefectFuture] = []
+    running: list[PrefectFuture] = []
+    n_pauses = 0
+    for item in items:
+        while True:
+            paused = memory_guard is not None and memory_guard.should_pause()
+            if running and (len(running) >= concurrency or paused):
+                if memory_guard is not None and memory_guard.n_pauses > n_pauses:
+                    n_pauses = memory_guard.n_pauses
+                    concurrency = max(1, min(concurrency, len(running) - 1))
+                    logger.warning(
+                        "Memory is close to the limit, pausing new tasks and lowering "
+                        f"the concurrency to {concurrency}"
+                    )
+                done = wait(running, timeout=poll_interval).done
+                running = [future for future in running if future not in done]
+                continue
+            break
+        future = submit(item)
+        futures.append(future)
+        running.append(future)
+    return futures
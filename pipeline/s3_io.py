@@ -0,0 +1,307 @@
+import base64
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+from mypy_boto3_s3 import S3Client
+from prefect.logging import get_logger
+from resources import MB
+
+logger = get_logger(__name__)
+
+# Every part of a multipart upload apart from the last must be at least 5 MiB
+DEFAULT_PART_SIZE = 8 * MB
+
+# Large objects are downloaded as byte ranges of this size, several at once
+DEFAULT_DOWNLOAD_PART_SIZE = 16 * MB
+DEFAULT_DOWNLOAD_CONCURRENCY = 8
+# The size of the chunks each part is read and written in
+DOWNLOAD_CHUNK_SIZE = 1 * MB
+
+# The most parts which S3 lists in one request for an object's attributes
+MAX_PARTS_PER_REQUEST = 1000
+
+
+def sha256_checksum(data: bytes) -> str:
+    """Get the SHA-256 checksum of some data, in the base64 form S3 uses."""
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+def stored_part_checksums(s3_client: S3Client, bucket_name: str, key: str) -> list:
+    """
+    Get the SHA-256 checksums which S3 stored for each part of an object.
+
+    Objects uploaded with a single PUT have a single part. The list is empty if the
+    object doesn't exist, and parts which were uploaded without a SHA-256 checksum
+    have a checksum of None, so they never match.
+    """
+    checksums = []
+    part_number_marker = 0
+    while True:
+        try:
+            attributes = s3_client.get_object_attributes(
+                Bucket=bucket_name,
+                Key=key,
+                ObjectAttributes=["Checksum", "ObjectParts"],
+                MaxParts=MAX_PARTS_PER_REQUEST,
+                PartNumberMarker=part_number_marker,
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return []
+            raise
+        object_parts = attributes.get("ObjectParts", {})
+        if not object_parts.get("TotalPartsCount"):
+            return [attributes.get("Checksum", {}).get("ChecksumSHA256")]
+        checksums.extend(
+            part.get("ChecksumSHA256") for part in object_parts.get("Parts", [])
+        )
+        next_part_number_marker = object_parts.get("NextPartNumberMarker")
+        if not object_parts.get("IsTruncated") or next_part_number_marker is None:
+            return checksums
+        part_number_marker = next_part_number_marker
+
+
+def put_object_if_changed(
+    s3_client: S3Client, bucket_name: str, key: str, data: bytes
+) -> bool:
+    """
+    Store an object, unless the stored object already has the same content.
+
+    The object is stored with its SHA-256 checksum, which S3 keeps alongside it, so
+    that the next upload can be compared with it. Returns whether the object was
+    uploaded.
+    """
+    checksum = sha256_checksum(data)
+    if stored_part_checksums(s3_client, bucket_name, key) == [checksum]:
+        return False
+    s3_client.put_object(
+        Bucket=bucket_name, Key=key, Body=data, ChecksumSHA256=checksum
+    )
+    return True
+
+
+class S3MultipartWriter:
+    """
+    Write an object to S3 as its data is produced, using a multipart upload.
+
+    Data is buffered until there's enough for a part, which is uploaded straight
+    away, so that only one part's worth of data is held in memory at a time. Objects
+    smaller than a single part are uploaded with a single PUT when the writer is
+    closed.
+
+    With `skip_unchanged`, the checksum of each part is compared with the checksum
+    S3 stored for the same part of the existing object. Parts which match are held
+    back in a temporary file rather than uploaded. As soon as a part differs, the
+    parts which were held back are uploaded and the rest of the object is streamed
+    as usual. If every part matches, the upload is skipped altogether (and `skipped`
+    is set), leaving the stored object and its ETag as they were.
+
+    Use the writer as a context manager: on a clean exit the upload is completed,
+    and if there's an exception it's aborted, leaving any existing object as it was.
+    """
+
+    def __init__(
+        self,
+        s3_client: S3Client,
+        bucket_name: str,
+        key: str,
+        part_size: int = DEFAULT_PART_SIZE,
+        skip_unchanged: bool = False,
+    ):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.bytes_written = 0
+        self.skipped = False
+        self._buffer = bytearray()
+        self._upload_id: str | None = None
+        self._parts: list[dict] = []
+        # The stored object's part checksums, for as long as every part so far has
+        # matched them
+        self._stored_checksums: list | None = (
+            stored_part_checksums(s3_client, bucket_name, key)
+            if skip_unchanged
+            else None
+        )
+        self._held_back = tempfile.TemporaryFile() if skip_unchanged else None
+        self._held_back_sizes: list[int] = []
+
+    def __enter__(self) -> "S3MultipartWriter":
+        """Start writing the object."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Complete the upload, or abort it if there was an exception."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data: bytes) -> None:
+        """Write data to the object, uploading a part whenever the buffer is full."""
+        self._buffer.extend(data)
+        self.bytes_written += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._flush_part()
+
+    def close(self) -> None:
+        """Upload any buffered data and complete the upload."""
+        if self._stored_checksums is not None:
+            checksums = self._stored_checksums[: len(self._held_back_sizes)]
+            if self._buffer or not self._held_back_sizes:
+                checksums.append(sha256_checksum(bytes(self._buffer)))
+            if checksums == self._stored_checksums:
+                self.skipped = True
+                self._stop_holding_back(upload=False)
+                self._buffer.clear()
+                return
+            self._stop_holding_back(upload=True)
+
+        if self._upload_id is None:
+            data = bytes(self._buffer)
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                Body=data,
+                ChecksumSHA256=sha256_checksum(data),
+            )
+            self._buffer.clear()
+            return
+
+        if self._buffer:
+            self._flush_part()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},  # type: ignore[typeddict-item]
+        )
+        self._upload_id = None
+
+    def abort(self) -> None:
+        """Abort the upload, discarding any parts which have been uploaded."""
+        self._buffer.clear()
+        self._stop_holding_back(upload=False)
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id
+            )
+            self._upload_id = None
+
+    def _flush_part(self) -> None:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        checksum = sha256_checksum(data)
+        if self._stored_checksums is not None:
+            n_held_back = len(self._held_back_sizes)
+            if (
+                n_held_back < len(self._stored_checksums)
+                and self._stored_checksums[n_held_back] == checksum
+            ):
+                assert self._held_back is not None
+                self._held_back.write(data)
+                self._held_back_sizes.append(len(data))
+                return
+            self._stop_holding_back(upload=True)
+        self._upload_part(data, checksum)
+
+    def _stop_holding_back(self, upload: bool) -> None:
+        """Stop comparing parts, uploading the parts which were held back."""
+        held_back, self._held_back = self._held_back, None
+        self._stored_checksums = None
+        if held_back is None:
+            return
+        with held_back:
+            if upload:
+                held_back.seek(0)
+                for size in self._held_back_sizes:
+                    data = held_back.read(size)
+                    self._upload_part(data, sha256_checksum(data))
+        self._held_back_sizes = []
+
+    def _upload_part(self, data: bytes, checksum: str) -> None:
+        if self._upload_id is None:
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, ChecksumAlgorithm="SHA256"
+            )
+            self._upload_id = response["UploadId"]
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data,
+            ChecksumSHA256=checksum,
+        )
+        self._parts.append(
+            {
+                "ETag": response["ETag"],
+                "PartNumber": part_number,
+                "ChecksumSHA256": checksum,
+            }
+        )
+
+
+def download_object_to_file(
+    s3_client: S3Client,
+    bucket_name: str,
+    key: str,
+    path: str | Path,
+    part_size: int = DEFAULT_DOWNLOAD_PART_SIZE,
+    concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY,
+) -> int:
+    """
+    Download an object to a local file, as concurrent byte-range GETs.
+
+    The file is preallocated to the object's size, and each part's data is written
+    straight to its place in the file as it arrives, so the object is never held in
+    memory. Every part is requested with the ETag of the object when the download
+    started, so that the download fails rather than mixing two versions of an
+    object which is replaced part way through.
+
+    Returns the size of the object in bytes.
+    """
+    start = time.perf_counter()
+    head = s3_client.head_object(Bucket=bucket_name, Key=key)
+    size = head["ContentLength"]
+    etag = head["ETag"]
+
+    def download_part(offset: int) -> None:
+        end = min(offset + part_size, size) - 1
+        body = s3_client.get_object(
+            Bucket=bucket_name, Key=key, Range=f"bytes={offset}-{end}", IfMatch=etag
+        )["Body"]
+        position = offset
+        for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+            os.pwrite(fd, chunk, position)
+            position += len(chunk)
+        if position != end + 1:
+            raise ValueError(
+                f"Expected {end + 1 - offset} bytes of {key} from {offset}, but got "
+                f"{position - offset}"
+            )
+
+    offsets = range(0, size, part_size)
+    n_connections = max(1, min(concurrency, len(offsets)))
+    with open(path, "wb") as file:
+        file.truncate(size)
+        fd = file.fileno()
+        with ThreadPoolExecutor(
+            max_workers=n_connections, thread_name_prefix="s3-download"
+        ) as executor:
+            # Consume the results so that any failed part raises here
+            list(executor.map(download_part, offsets))
+
+    seconds = time.perf_counter() - start
+    logger.info(
+        f"Downloaded {key} ({size / MB:.0f}MB) in {seconds:.1f}s, at "
+        f"{size / MB / max(seconds, 1e-9):.0f}MB/s with {n_connections} connections"
+    )
+    return size
@@ -0,0 +1,76 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, cast
+
+from prefect.logging import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# A route's handler gets the request's JSON body (an empty dict for GETs), and
+# returns something JSON-serialisable
+Handler = Callable[[dict], Any]
+
+
+class JSONServer(ThreadingHTTPServer):
+    """
+    A small HTTP server which routes JSON requests to handlers.
+
+    Routes are keyed on the method and path, eg `("POST", "/infer")`. A ValueError
+    from a handler is returned as a 400 response, and any other exception as a 500,
+    with the error message in the body.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        routes: dict[tuple[str, str], Handler],
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+    ):
+        self.routes = routes
+        super().__init__((host, port), _JSONRequestHandler)
+
+
+class _JSONRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        """Handle a GET request."""
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        """Handle a POST request."""
+        self._handle("POST")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests with the rest of the pipeline's logs."""
+        logger.info(f"{self.address_string()} - {format % args}")
+
+    def _handle(self, method: str) -> None:
+        handler = cast(JSONServer, self.server).routes.get(
+            (method, self.path.split("?")[0])
+        )
+        if handler is None:
+            self._respond(404, {"error": f"Not found: {method} {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            if not isinstance(body, dict):
+                raise ValueError("The request body should be a JSON object")
+            self._respond(200, handler(body))
+        except ValueError as e:
+            self._respond(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception(f"Failed to handle {method} {self.path}")
+            self._respond(500, {"error": str(e)})
+
+    def _respond(self, status: int, body: Any) -> None:
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
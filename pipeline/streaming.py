@@ -0,0 +1,101 @@
+import threading
+from queue import Empty, Full, Queue
+from typing import Any, Callable
+
+DEFAULT_QUEUE_SIZE = 1_000
+
+_END = object()
+
+
+class StreamingPipeline:
+    """
+    A chain of processing stages which run concurrently, connected by bounded queues.
+
+    Items put into the pipeline are passed to the first stage. Each stage runs in
+    its own thread, passing its result for each item (unless it's None) on to the
+    next stage. Because the queues between the stages are bounded, a slow stage
+    applies backpressure to the stages before it, rather than letting work pile up
+    in memory.
+
+    Use the pipeline as a context manager: on a clean exit, it waits for every item
+    to make its way through the stages. If any stage fails, the pipeline stops and
+    the stage's exception is raised from `put` or on exit.
+    """
+
+    def __init__(
+        self,
+        *stages: Callable[[Any], Any],
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+    ):
+        self._stages = stages
+        self._queues: list[Queue] = [Queue(maxsize=maxsize) for _ in stages]
+        self._stopped = threading.Event()
+        self._errors: list[BaseException] = []
+        self._threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(i,),
+                name=f"pipeline-stage-{i}-{getattr(stage, '__name__', 'stage')}",
+                daemon=True,
+            )
+            for i, stage in enumerate(stages)
+        ]
+
+    def __enter__(self) -> "StreamingPipeline":
+        """Start the stages' threads."""
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Wait for every item to pass through the stages, or stop on an error."""
+        try:
+            if exc_type is None:
+                self._put(0, _END)
+            else:
+                self._stopped.set()
+        finally:
+            for thread in self._threads:
+                thread.join()
+        if exc_type is None:
+            self._raise_if_failed()
+
+    def put(self, item: Any) -> None:
+        """Put an item into the first stage of the pipeline."""
+        self._put(0, item)
+
+    def _put(self, stage_index: int, item: Any) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._queues[stage_index].put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+        self._raise_if_failed()
+        raise RuntimeError("The pipeline was stopped")
+
+    def _run_stage(self, stage_index: int) -> None:
+        stage = self._stages[stage_index]
+        is_last_stage = stage_index == len(self._stages) - 1
+        try:
+            while True:
+                try:
+                    item = self._queues[stage_index].get(timeout=0.1)
+                except Empty:
+                    if self._stopped.is_set():
+                        return
+                    continue
+                if item is _END:
+                    if not is_last_stage:
+                        self._put(stage_index + 1, _END)
+                    return
+                result = stage(item)
+                if result is not None and not is_last_stage:
+                    self._put(stage_index + 1, result)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stopped.set()
+
+    def _raise_if_failed(self) -> None:
+        if self._errors:
+            raise self._errors[0]